@@ -0,0 +1,262 @@
+# order_record 歸檔：過去的月份搬到 ARCHIVE_DB 的 order_record_YYYY_MM，live 表只留近期資料
+# 另外定期做 WAL checkpoint 與 incremental vacuum，讓 live 資料庫維持精簡
+import datetime
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from models import get_db
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DB = os.getenv('ARCHIVE_DB', 'archive.sqlite3')
+# 除了本月之外，live 表再保留幾個完整月份（對帳通常看上個月）
+ARCHIVE_KEEP_MONTHS = int(os.getenv('ARCHIVE_KEEP_MONTHS', '1'))
+MAINTENANCE_SCHEDULER = os.getenv('MAINTENANCE_SCHEDULER', '1') == '1'
+# checkpoint / incremental vacuum 的間隔（秒），歸檔每天只做一次
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '600'))
+INCREMENTAL_VACUUM_PAGES = int(os.getenv('INCREMENTAL_VACUUM_PAGES', '2000'))
+
+# 歸檔庫的格式版本：1 加 tenant，2 加 price
+ARCHIVE_VERSION = 2
+
+ORDER_COLUMNS = 'id, tenant, user_id, date, meal_type, menu_item_id, quantity, price'
+
+
+def month_table(month):
+    return 'order_record_' + month.replace('-', '_')
+
+
+def next_month(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    return f'{year + mon // 12:04d}-{mon % 12 + 1:02d}'
+
+
+def archive_before(today, keep_months=ARCHIVE_KEEP_MONTHS):
+    # 早於這個日期（某月 1 號）的訂單可以歸檔
+    first = today.replace(day=1)
+    for _ in range(keep_months):
+        first = (first - datetime.timedelta(days=1)).replace(day=1)
+    return first.isoformat()
+
+
+@contextmanager
+def archive_attached(conn, create=False):
+    # 連線來自連線池，用完一定要 DETACH；只讀時歸檔檔案不存在就不掛，回傳 False
+    if not create and not os.path.exists(ARCHIVE_DB):
+        yield False
+        return
+    conn.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_DB,))
+    try:
+        conn.execute('''CREATE TABLE IF NOT EXISTS archive.archive_month (
+                            month TEXT PRIMARY KEY,
+                            rows INTEGER NOT NULL,
+                            archived_at REAL NOT NULL
+                        )''')
+        if conn.execute('PRAGMA archive.user_version').fetchone()[0] < ARCHIVE_VERSION:
+            upgrade_archive(conn)
+        yield True
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('DETACH DATABASE archive')
+
+
+def upgrade_archive(conn):
+    # 多群組之前歸檔的月份補上 tenant 欄位（都屬於 ''）
+    # 記錄單價之前歸檔的月份補上 price，與 live 表的 migration 一樣以目前菜單價格補
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # 多個 worker 可能同時升級，拿到寫入鎖後再確認一次
+        if conn.execute('PRAGMA archive.user_version').fetchone()[0] >= ARCHIVE_VERSION:
+            conn.rollback()
+            return
+        tables = conn.execute('''SELECT name FROM archive.sqlite_master
+                                 WHERE type='table' AND name LIKE 'order_record_%' ''').fetchall()
+        for (table,) in tables:
+            columns = [row[1] for row in conn.execute(f'PRAGMA archive.table_info({table})')]
+            if 'tenant' not in columns:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+            if 'price' not in columns:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN price INTEGER')
+                conn.execute(f'''UPDATE archive.{table}
+                                 SET price = (SELECT price FROM main.menu_item WHERE id = {table}.menu_item_id)''')
+                conn.execute(f'DROP INDEX IF EXISTS archive.idx_{table}_date_user')
+                create_month_index(conn, table)
+        conn.execute(f'PRAGMA archive.user_version={ARCHIVE_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def create_month_index(conn, table):
+    conn.execute(f'''CREATE INDEX IF NOT EXISTS archive.idx_{table}_date_user
+                     ON {table} (date, meal_type, user_id, menu_item_id, quantity, tenant, price)''')
+
+
+def archived_months(conn):
+    # 需先 archive_attached
+    return [row[0] for row in conn.execute('SELECT month FROM archive.archive_month ORDER BY month')]
+
+
+def history_sources(conn, start, end, attached):
+    # 回傳 [(資料表, 起始日期)]，依時間先後；已歸檔月份留在 live 表的殘留列不重複計算
+    sources = []
+    live_start = start
+    if attached:
+        months = archived_months(conn)
+        sources = [(f'archive.{month_table(m)}', start) for m in months if start[:7] <= m <= end[:7]]
+        if months:
+            live_start = max(start, next_month(months[-1]) + '-01')
+    sources.append(('main.order_record', live_start))
+    return sources
+
+
+@contextmanager
+def order_history(conn):
+    # 臨時的 order_history view：live 表 + 所有歸檔月份，給臨時查詢或報表用
+    with archive_attached(conn) as attached:
+        sources = history_sources(conn, '0000-01-01', '9999-12-31', attached)
+        union = ' UNION ALL '.join(f"SELECT {ORDER_COLUMNS} FROM {table} WHERE date >= '{start}'"
+                                   for table, start in sources)
+        conn.execute('DROP VIEW IF EXISTS temp.order_history')
+        conn.execute(f'CREATE TEMP VIEW order_history AS {union}')
+        try:
+            yield conn
+        finally:
+            conn.execute('DROP VIEW IF EXISTS temp.order_history')
+
+
+def archive_month(conn, month):
+    # 先在歸檔庫 commit 一份，再刪 live 表；中途中斷重跑也不會重複或遺失（INSERT OR IGNORE 以 id 去重）
+    table = month_table(month)
+    first, last = month + '-01', month + '-31'
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS archive.{table} (
+                             id INTEGER PRIMARY KEY,
+                             tenant TEXT NOT NULL DEFAULT '',
+                             user_id INTEGER NOT NULL,
+                             date TEXT NOT NULL,
+                             meal_type TEXT NOT NULL,
+                             menu_item_id INTEGER NOT NULL,
+                             quantity INTEGER NOT NULL,
+                             price INTEGER
+                         )''')
+        create_month_index(conn, table)
+        conn.execute(f'''INSERT OR IGNORE INTO archive.{table} ({ORDER_COLUMNS})
+                         SELECT {ORDER_COLUMNS} FROM main.order_record WHERE date BETWEEN ? AND ?''', (first, last))
+        rows = conn.execute(f'SELECT count(*) FROM archive.{table}').fetchone()[0]
+        conn.execute('INSERT OR REPLACE INTO archive.archive_month (month, rows, archived_at) VALUES (?, ?, ?)',
+                     (month, rows, time.time()))
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM main.order_record WHERE date BETWEEN ? AND ?', (first, last))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows
+
+
+def archive_orders(conn, today):
+    # 回傳 {月份: 歸檔後的筆數}；利用 date 開頭的索引找最舊的月份，一次處理一個月
+    before = archive_before(today)
+    archived = {}
+    with archive_attached(conn, create=True):
+        while True:
+            oldest = conn.execute('SELECT min(date) FROM order_record WHERE date < ?', (before,)).fetchone()[0]
+            if oldest is None:
+                return archived
+            archived[oldest[:7]] = archive_month(conn, oldest[:7])
+
+
+def enable_incremental_vacuum(conn):
+    # 把資料庫轉成 auto_vacuum=INCREMENTAL，需要一次完整 VACUUM（期間擋住所有寫入）
+    # 只在離峰手動執行 python archive.py 時做；已轉換過就直接回傳 False
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
+
+
+def compact(conn, pages=INCREMENTAL_VACUUM_PAGES, checkpoint_mode='PASSIVE'):
+    # 回傳 (釋放的頁數, checkpoint 結果)；排程只做這兩件短工作，不做完整 VACUUM
+    # 還沒轉成 auto_vacuum=INCREMENTAL 的資料庫 incremental_vacuum 不會有作用，只做 checkpoint
+    freed = 0
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA incremental_vacuum({pages})').fetchall()
+        freed = free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # 排程用 PASSIVE：不等讀取中的連線、不擋 order writer，做不完的下次再做
+    # TRUNCATE 會等讀取結束並把 -wal 檔縮回 0，只在手動執行（離峰）時使用
+    checkpoint = tuple(conn.execute(f'PRAGMA wal_checkpoint({checkpoint_mode})').fetchone())
+    return freed, checkpoint
+
+
+def run_maintenance(archive=True, checkpoint_mode='PASSIVE'):
+    conn = get_db()
+    try:
+        if archive:
+            archived = archive_orders(conn, datetime.date.today())
+            if archived:
+                logger.info('已歸檔：%s', archived)
+        freed, checkpoint = compact(conn, checkpoint_mode=checkpoint_mode)
+        logger.info('incremental vacuum 釋放 %d 頁，checkpoint %s', freed, checkpoint)
+        return freed, checkpoint
+    finally:
+        conn.close()
+
+
+class MaintenanceScheduler:
+    def __init__(self, interval=MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self.thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        # gunicorn fork 之後要在子行程重新啟動
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self.thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        archived_on = None
+        while not self._stop.wait(self.interval):
+            today = datetime.date.today()
+            try:
+                run_maintenance(archive=archived_on != today)
+                archived_on = today
+            except Exception:
+                logger.exception('資料庫維護失敗')
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self.thread.join(5)
+        self._pid = None
+
+
+maintenance_scheduler = MaintenanceScheduler()
+
+if __name__ == '__main__':
+    # 手動執行一次：python archive.py（第一次會順便轉成 auto_vacuum=INCREMENTAL，請在離峰時段執行）
+    logging.basicConfig(level=logging.INFO)
+    conn = get_db()
+    try:
+        if enable_incremental_vacuum(conn):
+            logger.info('已轉換為 auto_vacuum=INCREMENTAL')
+    finally:
+        conn.close()
+    run_maintenance(checkpoint_mode='TRUNCATE')
@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage
+
+import metrics
+from app import handler, build_reply, CHANNEL_ACCESS_TOKEN, LINE_API_ENDPOINT
+from cutoff import cutoff_scheduler, CUTOFF_SCHEDULER
+from archive import maintenance_scheduler, MAINTENANCE_SCHEDULER
+from line_client import make_aiohttp_session, make_async_line_bot_api, line_api_stats
+from models import pool_stats, DB_POOL_SIZE
+from order_writer import order_writer
+from reports import check_admin_token, parse_export_args, stream_export, export_filename, EXPORT_FORMATS
+from webhook_queue import event_key
+
+logger = logging.getLogger(__name__)
+
+# ASGI 入口（uvicorn asgi:app）：指令邏輯與 app.py 相同，
+# SQLite 在執行緒池執行、LINE API 走 aiohttp，同一個 webhook 內的多個事件並行處理
+# 每個事件只占用一條連線（session store 與 direct 寫入都共用它，order writer 有自己的連線），
+# 另留一條給截止排程、資料庫維護、顯示名稱更新與對帳匯出
+ASGI_DB_THREADS = int(os.getenv('ASGI_DB_THREADS', str(max(1, DB_POOL_SIZE - 1))))
+# 同時處理中的事件上限，超過時 /callback 會等有空位才回應（背壓）
+ASGI_MAX_IN_FLIGHT = int(os.getenv('ASGI_MAX_IN_FLIGHT', '1000'))
+
+
+class AsyncBot:
+    def __init__(self, db_threads=ASGI_DB_THREADS, max_in_flight=ASGI_MAX_IN_FLIGHT):
+        self.db_threads = db_threads
+        self.max_in_flight = max_in_flight
+        self.executor = None
+        self.session = None
+        self.api = None
+        self.slots = None
+        self.tasks = set()
+        # 同一位使用者的事件依序處理：key -> [Lock, 使用中的事件數]
+        self.user_locks = {}
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_in_flight_seen = 0
+
+    async def startup(self):
+        self.executor = ThreadPoolExecutor(self.db_threads, thread_name_prefix='asgi-db')
+        self.session = make_aiohttp_session()
+        self.api = make_async_line_bot_api(CHANNEL_ACCESS_TOKEN, LINE_API_ENDPOINT, self.session)
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        if CUTOFF_SCHEDULER:
+            cutoff_scheduler.start()
+        if MAINTENANCE_SCHEDULER:
+            maintenance_scheduler.start()
+
+    async def shutdown(self):
+        # 先處理完已收下的事件，再關連線與 order writer
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.session.close()
+        self.executor.shutdown(wait=True)
+        order_writer.shutdown()
+        cutoff_scheduler.shutdown()
+        maintenance_scheduler.shutdown()
+
+    async def submit(self, events):
+        for event in events:
+            if not (isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)):
+                continue
+            await self.slots.acquire()
+            self.received += 1
+            task = asyncio.create_task(self.process(event))
+            self.tasks.add(task)
+            self.max_in_flight_seen = max(self.max_in_flight_seen, len(self.tasks))
+            task.add_done_callback(self.tasks.discard)
+
+    async def process(self, event):
+        key = event_key(event)
+        entry = self.user_locks.get(key)
+        if entry is None:
+            entry = self.user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                loop = asyncio.get_running_loop()
+                message = await loop.run_in_executor(self.executor, build_reply, event)
+                with metrics.line_api('reply_message'):
+                    await self.api.reply_message(event.reply_token, message)
+            self.processed += 1
+        except Exception:
+            logger.exception('webhook event 處理失敗')
+            self.failed += 1
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.user_locks[key]
+            self.slots.release()
+
+    def stats(self):
+        return {
+            'mode': 'asgi',
+            'db_threads': self.db_threads,
+            'max_in_flight': self.max_in_flight,
+            'in_flight': len(self.tasks),
+            'max_in_flight_seen': self.max_in_flight_seen,
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+        }
+
+
+bot = AsyncBot()
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def respond(send, status, body, content_type='text/plain; charset=utf-8'):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def respond_json(send, payload):
+    await respond(send, 200, json.dumps(payload, ensure_ascii=False), 'application/json')
+
+
+async def callback(scope, receive, send):
+    with metrics.track_request():
+        body = (await read_body(receive)).decode('utf-8')
+        headers = dict(scope['headers'])
+        signature = headers.get(b'x-line-signature', b'').decode('latin-1')
+        try:
+            events = handler.parser.parse(body, signature)
+        except InvalidSignatureError:
+            return await respond(send, 400, 'Bad Request')
+        # 事件丟給背景 task，/callback 立即回 200
+        await bot.submit(events)
+        await respond(send, 200, 'OK')
+
+
+async def admin_export(scope, send):
+    headers = dict(scope['headers'])
+    if not check_admin_token(headers.get(b'x-admin-token', b'').decode('latin-1')):
+        return await respond(send, 403, 'Forbidden')
+    args = dict(urllib.parse.parse_qsl(scope['query_string'].decode('utf-8')))
+    try:
+        start, end, fmt, tenant = parse_export_args(args, datetime.date.today().isoformat())
+    except ValueError as e:
+        return await respond(send, 400, str(e))
+    disposition = f'attachment; filename={export_filename(start, end, fmt)}'
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', EXPORT_FORMATS[fmt][1].encode()),
+                            (b'content-disposition', disposition.encode())]})
+    # 查詢與格式化在執行緒池逐塊進行，不阻塞 event loop
+    loop = asyncio.get_running_loop()
+    chunks = stream_export(start, end, fmt, tenant)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(bot.executor, next, chunks, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        await loop.run_in_executor(bot.executor, chunks.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await bot.startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await bot.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    route = (scope['method'], scope['path'])
+    if route == ('POST', '/callback'):
+        await callback(scope, receive, send)
+    elif route == ('GET', '/webhook/stats'):
+        await respond_json(send, bot.stats())
+    elif route == ('GET', '/db/stats'):
+        await respond_json(send, pool_stats())
+    elif route == ('GET', '/line/stats'):
+        await respond_json(send, line_api_stats())
+    elif route == ('GET', '/admin/export'):
+        await admin_export(scope, send)
+    elif route == ('GET', '/metrics'):
+        text = metrics.render({'bot_db_pool': pool_stats(), 'bot_webhook': bot.stats(),
+                               'bot_order_writer': order_writer.stats()})
+        await respond(send, 200, text, 'text/plain; version=0.0.4')
+    else:
+        await respond(send, 404, 'Not Found')
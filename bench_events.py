@@ -0,0 +1,112 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+from catalogue import load_catalogue
+from models import DB_NAME, connect, init_db
+
+# 產生壓測用的 webhook 內容，簽章與 LINE 平台相同（HMAC-SHA256 + base64）
+BENCH_SECRET = os.getenv('LINE_CHANNEL_SECRET', 'bench-secret')
+BENCH_ADMIN = 'Ubenchadmin'
+
+
+def sign(body, secret=BENCH_SECRET):
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def message_event(text, user_id, group_id=None):
+    source = {'type': 'user', 'userId': user_id}
+    if group_id:
+        source = {'type': 'group', 'groupId': group_id, 'userId': user_id}
+    return {
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'source': source,
+        'webhookEventId': uuid.uuid4().hex,
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': uuid.uuid4().hex,
+        'message': {'type': 'text', 'id': str(uuid.uuid4().int)[:18], 'text': text},
+    }
+
+
+def webhook_body(events):
+    return json.dumps({'destination': 'Ubench', 'events': events}, ensure_ascii=False)
+
+
+def pick_fixtures(catalogue):
+    # 今日餐廳設成名稱含「茶」的飲料店，點餐 / 飲料流程才會寫入訂單；
+    # 餐點流程只檢查有沒有今日餐廳，任何餐廳的品項都能點
+    drink_shop = next(r for r in catalogue.by_type.get('飲料店', []) if '茶' in r.name or '飲料' in r.name)
+    restaurant = catalogue.by_type['餐廳'][0]
+    return {
+        'drink_shop': drink_shop.name,
+        'restaurant': restaurant.name,
+        'drinks': catalogue.items_by_restaurant[drink_shop.id],
+        'foods': catalogue.items_by_restaurant[restaurant.id],
+    }
+
+
+def load_fixtures(database=DB_NAME):
+    # 舊資料庫要先跑完 migration 才讀得到菜單快照；在暫存複本上跑，不會改動正式資料庫
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, 'fixtures.sqlite3'))
+        try:
+            src = sqlite3.connect(database)
+            src.backup(conn)
+            src.close()
+            init_db(conn)
+            return pick_fixtures(load_catalogue(conn))
+        finally:
+            conn.close()
+
+
+def setup_script(fixtures):
+    return [f"今日餐廳 {fixtures['drink_shop']} 中餐", f"今日餐廳 {fixtures['drink_shop']} 晚餐"]
+
+
+def user_script(n, fixtures):
+    # 一位使用者在尖峰時段的完整操作，涵蓋 handle_message 的主要指令
+    drinks, foods = fixtures['drinks'], fixtures['foods']
+    drink = drinks[n % len(drinks)]
+    food = foods[n % len(foods)]
+    other = drinks[(n * 7 + 3) % len(drinks)]
+    return [
+        f"菜單 {fixtures['restaurant']}",
+        f"點餐 {drink.name} 1",
+        food.code, '2',
+        other.code, '甜度5', '冰塊3', '1',
+        f"搜尋 {drink.name[:3]}",
+        '統計',
+    ]
+
+
+def generate(users, fixtures, secret=BENCH_SECRET, group_id=None):
+    # 每則訊息一個 webhook 請求；同一位使用者的訊息必須依序送出
+    scripts = [(BENCH_ADMIN, setup_script(fixtures))]
+    scripts += [(f'Ubench{n:06d}', user_script(n, fixtures)) for n in range(users)]
+    for user_id, texts in scripts:
+        for seq, text in enumerate(texts):
+            body = webhook_body([message_event(text, user_id, group_id)])
+            yield {'user': user_id, 'seq': seq, 'text': text, 'body': body, 'signature': sign(body, secret)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='產生已簽章的壓測 webhook 事件（JSONL）')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--group', default=None, help='以群組訊息送出')
+    parser.add_argument('--secret', default=BENCH_SECRET)
+    parser.add_argument('--db', default=DB_NAME, help='讀取菜單的資料庫（只讀，不會套用 migration）')
+    args = parser.parse_args()
+    fixtures = load_fixtures(args.db)
+    for record in generate(args.users, fixtures, args.secret, args.group):
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_events import BENCH_ADMIN, BENCH_SECRET
+
+# 重播壓測事件到 /callback：同一位使用者依序送，不同使用者並行
+LOCK_ERROR = 'database is locked'
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def load_records(path, users, database):
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    from bench_events import generate, load_fixtures
+    return list(generate(users, load_fixtures(database)))
+
+
+def group_by_user(records):
+    scripts = {}
+    for record in records:
+        scripts.setdefault(record['user'], []).append(record)
+    for script in scripts.values():
+        script.sort(key=lambda r: r['seq'])
+    return scripts
+
+
+def get_json(url, timeout=5):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+class Replayer:
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self.latencies = []
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def post(self, record):
+        req = urllib.request.Request(self.url, data=record['body'].encode('utf-8'), method='POST', headers={
+            'Content-Type': 'application/json',
+            'X-Line-Signature': record['signature'],
+        })
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def run_script(self, script):
+        for record in script:
+            self.post(record)
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return True
+        except urllib.error.HTTPError:
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def wait_for_replies(stub_url, expected, timeout=30):
+    # thread 模式下 /callback 先回 200，回覆稍後才送到替身
+    deadline = time.monotonic() + timeout
+    stats = get_json(stub_url + '/stats') or {}
+    while stats.get('reply', 0) < expected and time.monotonic() < deadline:
+        time.sleep(0.2)
+        stats = get_json(stub_url + '/stats') or {}
+    return stats
+
+
+def spawn_server(args, stub_url, workdir):
+    # 用資料庫副本啟動 bot，避免壓測訂單寫進正式資料
+    # 用 backup() 而不是複製檔案：最新的內容可能還在 -wal 裡
+    db_path = os.path.join(workdir, 'bench.sqlite3')
+    src, dst = sqlite3.connect(args.db), sqlite3.connect(db_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    env = dict(os.environ, DB_NAME=db_path, LINE_API_ENDPOINT=stub_url,
+               LINE_CHANNEL_SECRET=args.secret, LINE_CHANNEL_ACCESS_TOKEN='bench-token')
+    log = open(os.path.join(workdir, 'server.log'), 'w+', encoding='utf-8')
+    cmd = args.server_cmd.format(port=args.port).split()
+    return subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT), log
+
+
+def main():
+    parser = argparse.ArgumentParser(description='並行重播 webhook 事件，統計延遲與 SQLite 鎖定錯誤')
+    parser.add_argument('--events', help='bench_events.py 產生的 JSONL；未指定則直接產生')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--url', default='http://127.0.0.1:5000/callback')
+    parser.add_argument('--stub', default='http://127.0.0.1:8081', help='LINE API 替身位址，用來核對回覆數')
+    parser.add_argument('--spawn', action='store_true', help='自行啟動替身與 bot（使用資料庫副本）')
+    parser.add_argument('--server-cmd', default='gunicorn -w 4 -b 127.0.0.1:{port} app:app')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--db', default='db.sqlite3')
+    parser.add_argument('--latency', type=float, default=50.0)
+    parser.add_argument('--secret', default=BENCH_SECRET)
+    args = parser.parse_args()
+
+    records = load_records(args.events, args.users, args.db)
+    scripts = group_by_user(records)
+    setup = scripts.pop(BENCH_ADMIN, [])
+
+    server = log = stub = None
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    url, stub_url = args.url, args.stub
+    try:
+        if args.spawn:
+            from line_stub import LineStub
+            stub = LineStub(latency_ms=args.latency).start()
+            stub_url = stub.url
+            server, log = spawn_server(args, stub_url, workdir)
+            url = f'http://127.0.0.1:{args.port}/callback'
+            if not wait_for(url):
+                sys.exit('bot 沒有啟動，請看 ' + log.name)
+        base_url = url.rsplit('/', 1)[0]
+        replies_before = (get_json(stub_url + '/stats') or {}).get('reply', 0)
+        webhook_before = get_json(base_url + '/webhook/stats') or {}
+
+        replayer = Replayer(url)
+        replayer.run_script(setup)
+        replayer.latencies.clear()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(replayer.run_script, scripts.values()))
+        elapsed = time.perf_counter() - started
+
+        expected = replies_before + len(records)
+        stub_stats = wait_for_replies(stub_url, expected)
+        webhook_after = get_json(base_url + '/webhook/stats') or {}
+        latencies = sorted(replayer.latencies)
+        report = {
+            'users': len(scripts),
+            'requests': len(latencies),
+            'concurrency': args.concurrency,
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            'status': {str(k): v for k, v in sorted(replayer.statuses.items(), key=str)},
+            'replies_missing': max(0, expected - stub_stats.get('reply', 0)) if stub_stats else None,
+            'webhook_failed': webhook_after.get('failed', 0) - webhook_before.get('failed', 0),
+        }
+        if log:
+            log.flush()
+            log.seek(0)
+            report['sqlite_lock_errors'] = log.read().count(LOCK_ERROR)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(10)
+        if log:
+            log.close()
+        if stub:
+            stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
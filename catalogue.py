@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+from models import get_db, get_menu_generation
+from fuzzy import NgramIndex
+
+# 多久檢查一次 menu_generation（秒），其餘時間完全不碰資料庫
+CATALOGUE_CHECK_INTERVAL = float(os.getenv('CATALOGUE_CHECK_INTERVAL', '5'))
+
+Restaurant = namedtuple('Restaurant', 'id name code type active')
+MenuItem = namedtuple('MenuItem', 'id code name price note category_id category restaurant_id')
+
+
+def render_menu(restaurant_name, items):
+    # 與原本「菜單」回覆相同格式
+    lines = [f"{restaurant_name} 菜單："]
+    last_cat = None
+    for item in items:
+        if item.category != last_cat:
+            lines.append(f"\n【{item.category}】")
+            last_cat = item.category
+        lines.append(f"[{item.code}] {item.name} ${item.price}")
+    return "\n".join(lines)
+
+
+class Catalogue:
+    # 唯讀的菜單快照，載入後不再修改
+    def __init__(self, generation, restaurants, items, previous=None):
+        self.generation = generation
+        # 已下架的餐廳仍保留在 restaurants，舊的今日餐廳/點餐紀錄還查得到名稱
+        self.restaurants = {r.id: r for r in restaurants}
+        self.by_name = {r.name: r for r in restaurants if r.active}
+        self.by_type = {}
+        for r in restaurants:
+            if r.active:
+                self.by_type.setdefault(r.type, []).append(r)
+        self.items = {i.id: i for i in items}
+        self.by_code = {i.code: i for i in items if i.code}
+        self.by_restaurant_name = {}
+        per_restaurant = {}
+        for i in items:
+            per_restaurant.setdefault(i.restaurant_id, []).append(i)
+            self.by_restaurant_name.setdefault((i.restaurant_id, i.name), i)
+        self.items_by_restaurant = per_restaurant
+        self.menu_text = {rid: render_menu(self.restaurants[rid].name, rows)
+                          for rid, rows in per_restaurant.items()}
+        # 每家店的品名 bigram 索引；品項沒變的餐廳直接沿用上一版的索引
+        self.name_indexes = {}
+        for rid, rows in per_restaurant.items():
+            if previous is not None and previous.items_by_restaurant.get(rid) == rows:
+                self.name_indexes[rid] = previous.name_indexes[rid]
+            else:
+                self.name_indexes[rid] = NgramIndex(rows)
+
+    def restaurant_of(self, item):
+        return self.restaurants[item.restaurant_id]
+
+    def search_items(self, restaurant_id, query, limit=5):
+        index = self.name_indexes.get(restaurant_id)
+        return index.search(query, limit) if index else []
+
+
+def load_catalogue(conn, previous=None):
+    # 在同一個讀取交易內取 generation 與資料，避免讀到匯入一半的版本
+    conn.execute('BEGIN')
+    try:
+        generation = get_menu_generation(conn)
+        restaurants = [Restaurant(row['id'], row['name'], row['code'], row['type'], row['active'])
+                       for row in conn.execute('SELECT id, name, code, type, active FROM restaurant ORDER BY id')]
+        items = [MenuItem(row['id'], row['code'], row['name'], row['price'], row['note'],
+                          row['category_id'], row['category'], row['restaurant_id'])
+                 for row in conn.execute('''SELECT mi.id, mi.code, mi.name, mi.price, mi.note, mi.category_id,
+                                                   mc.name as category, mc.restaurant_id
+                                            FROM menu_category mc
+                                            JOIN menu_item mi ON mi.category_id = mc.id
+                                            JOIN restaurant r ON mc.restaurant_id = r.id
+                                            WHERE r.active=1 AND mc.active=1 AND mi.active=1
+                                            ORDER BY mc.restaurant_id, mc.id, mi.id''')]
+    finally:
+        conn.rollback()
+    return Catalogue(generation, restaurants, items, previous)
+
+
+_lock = threading.Lock()
+_catalogue = None
+_checked_at = 0.0
+
+def get_catalogue(conn=None):
+    global _catalogue, _checked_at
+    current = _catalogue
+    if current is not None and time.monotonic() - _checked_at < CATALOGUE_CHECK_INTERVAL:
+        return current
+    with _lock:
+        if _catalogue is not None and time.monotonic() - _checked_at < CATALOGUE_CHECK_INTERVAL:
+            return _catalogue
+        own = conn is None
+        if own:
+            conn = get_db()
+        try:
+            if _catalogue is None or get_menu_generation(conn) != _catalogue.generation:
+                _catalogue = load_catalogue(conn, _catalogue)
+            _checked_at = time.monotonic()
+        finally:
+            if own:
+                conn.close()
+        return _catalogue
+
+def invalidate():
+    # 同一行程內匯入後可立即重新載入
+    global _checked_at
+    _checked_at = 0.0
@@ -0,0 +1,503 @@
+import datetime
+import re
+import time
+from concurrent.futures import TimeoutError as WriteTimeout
+
+from linebot.models import TextSendMessage, QuickReply, QuickReplyButton, MessageAction
+
+import metrics
+from order_writer import order_writer, OrderWrite
+from favorites import top_favorites
+from orders import MealClosed, get_summary_text, is_meal_closed
+from picker import RestaurantPicker, record_pick
+from search import search_items
+from session_store import make_session_store, PendingOrder
+
+# 點餐截止時間：截止前下的單算該餐
+MEAL_WINDOWS = ((datetime.time(9, 0), "中餐"), (datetime.time(17, 0), "晚餐"))
+MEAL_TYPES = ("中餐", "晚餐")
+MEAL_DEADLINES = {meal_type: deadline for deadline, meal_type in MEAL_WINDOWS}
+RANDOM_MEAL_TYPES = {"午餐": "中餐", "晚餐": "晚餐"}
+QUANTITY_CHOICES = frozenset(str(i) for i in range(1, 6))
+# 統一甜度冰塊選單為 0,1,3,5,7
+SUGAR_ICE_OPTIONS = [0, 1, 3, 5, 7]
+PAGE_SIZE = 10
+ITEM_CODE_RE = re.compile(r'[A-Za-z]{2}[0-9]{2}')
+# 一次點多項：點餐 AA01x2 AA05 BC03x1（沒寫數量算 1 份）
+ORDER_LINE_RE = re.compile(r'([A-Za-z]{2}[0-9]{2})(?:[xX*×＊]([0-9]{1,2}))?')
+# 找不到品名時最多提供幾個相近品項
+SUGGESTION_LIMIT = 5
+# LINE quick reply 按鈕文字上限
+QUICK_REPLY_LABEL_MAX = 20
+# 常點最多列出幾項
+FAVORITE_LIMIT = 5
+
+# 今日餐廳查詢（query_plans.py 也用同一段 SQL 檢查索引）
+TODAY_RESTAURANT_SQL = 'SELECT restaurant_id FROM today_restaurant WHERE tenant=? AND date=? AND meal_type=?'
+TODAY_RESTAURANT_ANY_MEAL_SQL = '''SELECT restaurant_id FROM today_restaurant
+                                   WHERE tenant=? AND date=? AND (meal_type=? OR meal_type=?)'''
+
+# quick reply 流程的暫存狀態（SESSION_STORE=sqlite 時可跨 worker 共用）
+pending_orders = make_session_store()
+# 隨便吃 / 隨便喝的加權抽樣表
+restaurant_picker = RestaurantPicker()
+
+
+def current_meal(now):
+    for deadline, meal_type in MEAL_WINDOWS:
+        if now < deadline:
+            return meal_type, deadline
+    return None, None
+
+
+def tenant_of(source):
+    # 群組 / 聊天室各自獨立（今日餐廳、訂單、統計）；一對一聊天共用 ''
+    return getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or ''
+
+
+def is_drink_shop(restaurant_name):
+    return ("飲料" in restaurant_name) or ("茶" in restaurant_name)
+
+
+def text_reply(text, options=None):
+    # options: [(label, text)]，有的話附上 quick reply 按鈕
+    if not options:
+        return TextSendMessage(text=text)
+    items = [QuickReplyButton(action=MessageAction(label=label, text=value)) for label, value in options]
+    return TextSendMessage(text=text, quick_reply=QuickReply(items=items))
+
+
+class CommandContext:
+    # 一則訊息處理期間共用的資料：連線、今日日期、餐別
+    def __init__(self, event, conn, catalogue, today, now, profile_cache):
+        self.event = event
+        self.user_id = event.source.user_id
+        self.tenant = tenant_of(event.source)
+        # quick reply 流程以 (群組, 使用者) 為單位
+        self.session_key = (self.tenant, self.user_id)
+        self.text = event.message.text.strip()
+        self.args = self.text.split()[1:]
+        self.conn = conn
+        self.catalogue = catalogue
+        self.today = today
+        self.now = now
+        self.profile_cache = profile_cache
+        # /metrics 的指令名稱；fallback 會改成實際走到的分支
+        self.command = None
+        self._meal = None
+
+    @property
+    def meal_type(self):
+        # 目前可點的餐別；超過所有截止時間為 None
+        if self._meal is None:
+            self._meal = current_meal(self.now)
+        return self._meal[0]
+
+    def today_restaurant_id(self, meal_type):
+        row = self.conn.execute(TODAY_RESTAURANT_SQL, (self.tenant, self.today, meal_type)).fetchone()
+        return row[0] if row else None
+
+    def set_today_restaurant(self, meal_type, restaurant_id):
+        # 截止後報表已凍結，不能再換餐廳（換了之後統計會找不到凍結的報表）
+        # 與 order_writer 擋截止後的訂單一樣：先看時間與本行程的截止清單，再在寫入鎖內確認其他行程是否已截止
+        if MEAL_DEADLINES[meal_type] <= self.now or (self.today, meal_type) in order_writer.closed_meals:
+            raise MealClosed(self.today, meal_type)
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            if is_meal_closed(self.conn, self.today, meal_type):
+                raise MealClosed(self.today, meal_type)
+            self.conn.execute('''INSERT OR REPLACE INTO today_restaurant (tenant, date, meal_type, restaurant_id)
+                                 VALUES (?, ?, ?, ?)''', (self.tenant, self.today, meal_type, restaurant_id))
+            record_pick(self.conn, restaurant_id, self.today)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def save_order(self, meal_type, lines):
+        # lines：[(MenuItem, 數量)]，在同一個交易寫入
+        # 顯示名稱先在這裡查好；註冊用戶與寫入訂單交給 order_writer 批次 commit，落盤後才返回
+        # direct 模式用這則訊息的連線寫入
+        display_name = self.profile_cache.get(self.user_id, self.conn)
+        return order_writer.write(OrderWrite(self.tenant, self.user_id, display_name, self.today, meal_type, tuple(lines)),
+                                  self.conn)
+
+
+# --- 指令註冊表 ---
+PREFIX_COMMANDS = {}
+EXACT_COMMANDS = {}
+_prefix_lengths = []
+
+def command(*keywords, exact=False):
+    def decorator(func):
+        table = EXACT_COMMANDS if exact else PREFIX_COMMANDS
+        for keyword in keywords:
+            table[keyword] = func
+        _prefix_lengths[:] = sorted({len(k) for k in PREFIX_COMMANDS}, reverse=True)
+        return func
+    return decorator
+
+def route(text):
+    # 先比對完整指令，再依關鍵字長度由長到短比對開頭；與指令數量無關
+    handler = EXACT_COMMANDS.get(text)
+    if handler:
+        return handler
+    for n in _prefix_lengths:
+        handler = PREFIX_COMMANDS.get(text[:n])
+        if handler:
+            return handler
+    return fallback
+
+def handle(ctx):
+    handler = route(ctx.text)
+    ctx.command = handler.__name__
+    started = time.perf_counter()
+    try:
+        return handler(ctx)
+    except MealClosed as e:
+        # 截止後才寫入的訂單（例如截止前就在等數量回覆）
+        return text_reply(f"今日{e.meal_type}已截止，這筆點餐沒有登記。")
+    except WriteTimeout:
+        # order writer 逾時：訂單仍可能稍後寫入，請使用者先確認再決定要不要重點
+        metrics.COMMAND_ERRORS.inc(ctx.command)
+        return text_reply("系統忙碌中，這筆點餐可能仍在處理，請稍後輸入「統計」確認，避免重複點餐。")
+    except Exception:
+        metrics.COMMAND_ERRORS.inc(ctx.command)
+        raise
+    finally:
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - started, ctx.command)
+
+
+# --- 設定今日餐廳（需指定餐別）---
+@command("今日餐廳")
+def set_today(ctx):
+    if len(ctx.args) < 2:
+        return text_reply("請輸入：今日餐廳 餐廳名稱 中餐/晚餐")
+    restaurant_name, meal_type = ctx.args[0], ctx.args[1]
+    if meal_type not in MEAL_TYPES:
+        return text_reply("餐別請輸入『中餐』或『晚餐』")
+    r = ctx.catalogue.by_name.get(restaurant_name)
+    if not r:
+        return text_reply(f"找不到餐廳：{restaurant_name}")
+    try:
+        ctx.set_today_restaurant(meal_type, r.id)
+    except MealClosed:
+        return text_reply(f"今日{meal_type}已截止，不能再更改餐廳。")
+    return text_reply(f"今日{meal_type}已設定為：{restaurant_name}")
+
+
+# --- 點餐（自動判斷餐別與截止時間）---
+@command("點餐")
+def order_by_name(ctx):
+    meal_type = ctx.meal_type
+    if not meal_type:
+        return text_reply("目前已超過所有點餐截止時間。")
+    if ctx.args and all(ORDER_LINE_RE.fullmatch(arg) for arg in ctx.args):
+        return order_by_codes(ctx, meal_type)
+    if len(ctx.args) < 2:
+        # 剛開始點餐時附上常點品項，一鍵下單
+        restaurant_id = ctx.today_restaurant_id(meal_type)
+        return text_reply("請輸入：點餐 品項 數量（例如：點餐 招牌雞腿便當 2）",
+                          favorite_options(ctx, restaurant_id) if restaurant_id else None)
+    # 最後一個參數是數量，前面都算品名（品名可能含空白）
+    item_name = " ".join(ctx.args[:-1])
+    try:
+        quantity = int(ctx.args[-1])
+    except ValueError:
+        return text_reply("請輸入正確的數量（例如：點餐 招牌雞腿便當 2）")
+    restaurant_id = ctx.today_restaurant_id(meal_type)
+    if not restaurant_id:
+        return text_reply(f"請先設定今日{meal_type}餐廳。")
+    item = ctx.catalogue.by_restaurant_name.get((restaurant_id, item_name))
+    if not item:
+        return suggest_items(ctx, restaurant_id, item_name, quantity)
+    ctx.save_order(meal_type, [(item, quantity)])
+    return text_reply(f"已為你登記：{item_name} x{quantity}（{meal_type}）")
+
+
+def order_by_codes(ctx, meal_type):
+    restaurant_id = ctx.today_restaurant_id(meal_type)
+    if not restaurant_id:
+        return text_reply(f"請先設定今日{meal_type}餐廳。")
+    # 一次解析完所有品項；同一品項出現多次就合併數量
+    quantities = {}
+    errors = []
+    for arg in ctx.args:
+        m = ORDER_LINE_RE.fullmatch(arg)
+        item = ctx.catalogue.by_code.get(m.group(1).upper())
+        quantity = int(m.group(2) or 1)
+        if not item:
+            errors.append(f"找不到品項編號：{m.group(1)}")
+        elif item.restaurant_id != restaurant_id:
+            errors.append(f"[{item.code}] {item.name} 不是今日{meal_type}餐廳的品項")
+        elif quantity < 1:
+            errors.append(f"[{item.code}] {item.name} 的數量需至少 1 份")
+        else:
+            quantities[item] = quantities.get(item, 0) + quantity
+    if errors:
+        return text_reply("\n".join(errors + ["以上品項有誤，這次的點餐都沒有登記。"]))
+    lines = list(quantities.items())
+    ctx.save_order(meal_type, lines)
+    replies = [f"已為你登記（{meal_type}）："]
+    replies += [f"[{item.code}] {item.name} ${item.price} x{quantity}" for item, quantity in lines]
+    replies.append(f"合計：${sum(item.price * quantity for item, quantity in lines)}")
+    return text_reply("\n".join(replies))
+
+
+def suggest_items(ctx, restaurant_id, item_name, quantity):
+    # 品名不完全相符時，用 bigram 索引找相近品項做成按鈕
+    candidates = ctx.catalogue.search_items(restaurant_id, item_name, SUGGESTION_LIMIT)
+    if not candidates:
+        return text_reply(f"找不到品項：{item_name}")
+    options = [(item.name[:QUICK_REPLY_LABEL_MAX], f"點餐 {item.name} {quantity}") for _, item in candidates]
+    return text_reply(f"找不到品項：{item_name}\n你是不是要點：", options)
+
+
+# --- 統計（可指定餐別）---
+@command("統計")
+def summary(ctx):
+    if len(ctx.args) == 1 and ctx.args[0] in MEAL_TYPES:
+        meal_type = ctx.args[0]
+    else:
+        # 預設自動判斷目前是哪一餐，晚上查詢預設查晚餐
+        meal_type = ctx.meal_type or "晚餐"
+    restaurant_id = ctx.today_restaurant_id(meal_type)
+    if not restaurant_id:
+        return text_reply(f"今日{meal_type}尚未設定餐廳。")
+    restaurant_name = ctx.catalogue.restaurants[restaurant_id].name
+    # 預先加總好的統計（有快取文字就直接回傳）
+    return text_reply(get_summary_text(ctx.conn, ctx.tenant, ctx.today, meal_type, restaurant_id, restaurant_name))
+
+
+# --- 查詢餐廳 / 飲料店清單（分頁）---
+def list_shops(ctx, shop_type, keyword, label):
+    page = 1
+    if len(ctx.args) == 1 and ctx.args[0].isdigit():
+        page = int(ctx.args[0])
+    offset = (page - 1) * PAGE_SIZE
+    shops = ctx.catalogue.by_type.get(shop_type, [])
+    options = [(r.name, f"菜單 {r.name}") for r in shops[offset:offset + PAGE_SIZE]]
+    # 分頁按鈕
+    max_page = (len(shops) + PAGE_SIZE - 1) // PAGE_SIZE
+    if page > 1:
+        options.append(("上一頁", f"{keyword} {page-1}"))
+    if page < max_page:
+        options.append(("下一頁", f"{keyword} {page+1}"))
+    if not options:
+        return text_reply(f"目前沒有{label}資料。")
+    return text_reply(f"請選擇{label}（第{page}/{max_page}頁）：", options)
+
+@command("餐廳", "查詢餐廳")
+def list_restaurants(ctx):
+    return list_shops(ctx, '餐廳', "餐廳", "餐廳")
+
+@command("飲料", "查詢飲料店")
+def list_drink_shops(ctx):
+    return list_shops(ctx, '飲料店', "飲料", "飲料店")
+
+
+# --- 查詢餐廳菜單（一次顯示所有品項，含唯一編號）---
+@command("菜單")
+def menu(ctx):
+    if len(ctx.args) != 1:
+        return text_reply("請輸入：菜單 餐廳名稱")
+    restaurant_name = ctx.args[0]
+    r = ctx.catalogue.by_name.get(restaurant_name)
+    if not r:
+        return text_reply(f"找不到餐廳：{restaurant_name}")
+    # 預先產生的菜單文字（含 code）
+    return text_reply(ctx.catalogue.menu_text.get(r.id) or f"{restaurant_name} 尚無菜單資料。")
+
+
+# --- 隨便吃 / 隨便喝 午/晚餐 ---
+@command("隨便吃")
+def random_restaurant(ctx):
+    if len(ctx.args) != 1 or ctx.args[0] not in RANDOM_MEAL_TYPES:
+        return text_reply("請輸入：隨便吃 午餐/晚餐")
+    meal_type = ctx.args[0]
+    rows = ctx.catalogue.by_type.get('餐廳')
+    if not rows:
+        return text_reply("目前沒有餐廳資料。")
+    # 依人氣加權，最近選過的店不會再抽到
+    choice = restaurant_picker.pick(ctx.conn, rows, ctx.today)
+    # 保存到今日餐廳表
+    try:
+        ctx.set_today_restaurant(RANDOM_MEAL_TYPES[meal_type], choice.id)
+    except MealClosed:
+        return text_reply(f"今日{meal_type}已截止，不能再更改餐廳。")
+    return text_reply(f"今天{meal_type}就決定吃：{choice.name}")
+
+@command("隨便喝")
+def random_drink_shop(ctx):
+    if len(ctx.args) != 1 or ctx.args[0] not in RANDOM_MEAL_TYPES:
+        return text_reply("請輸入：隨便喝 午餐/晚餐")
+    rows = ctx.catalogue.by_type.get('飲料店')
+    if not rows:
+        return text_reply("目前沒有飲料店資料。")
+    choice = restaurant_picker.pick(ctx.conn, rows, ctx.today)
+    record_pick(ctx.conn, choice.id, ctx.today)
+    ctx.conn.commit()
+    return text_reply(f"今天{ctx.args[0]}就決定喝：{choice.name}")
+
+
+# --- 吃啥 / 喝啥：今日店家的菜單 ---
+def todays_restaurant_any_meal(ctx):
+    row = ctx.conn.execute(TODAY_RESTAURANT_ANY_MEAL_SQL, (ctx.tenant, ctx.today, "中餐", "晚餐")).fetchone()
+    return row[0] if row else None
+
+@command("吃啥", exact=True)
+def todays_menu(ctx):
+    restaurant_id = todays_restaurant_any_meal(ctx)
+    if not restaurant_id:
+        return text_reply("請先設定今日餐廳。")
+    restaurant_name = ctx.catalogue.restaurants[restaurant_id].name
+    return text_reply(ctx.catalogue.menu_text.get(restaurant_id) or f"{restaurant_name} 尚無菜單資料。",
+                      favorite_options(ctx, restaurant_id))
+
+@command("喝啥", exact=True)
+def todays_drink_menu(ctx):
+    restaurant_id = todays_restaurant_any_meal(ctx)
+    if not restaurant_id:
+        return text_reply("請先設定今日飲料店。")
+    # 檢查這個 id 是否為飲料店
+    rest = ctx.catalogue.restaurants.get(restaurant_id)
+    if not rest or rest.type != '飲料店':
+        return text_reply("今日尚未設定飲料店。")
+    return text_reply(ctx.catalogue.menu_text.get(restaurant_id) or f"{rest.name} 尚無菜單資料。")
+
+
+# --- 常點：今日店家中自己點過最多次的品項，按一下就下單 ---
+def favorite_options(ctx, restaurant_id):
+    # 餐點直接送出「點餐 品名 份數」；飲料送 code，接著選甜度冰塊
+    drink = is_drink_shop(ctx.catalogue.restaurants[restaurant_id].name)
+    options = []
+    for menu_item_id, times, quantity in top_favorites(ctx.conn, ctx.user_id, restaurant_id, FAVORITE_LIMIT):
+        item = ctx.catalogue.items.get(menu_item_id)
+        if not item:
+            continue
+        if drink:
+            options.append((item.name[:QUICK_REPLY_LABEL_MAX], item.code))
+        else:
+            usual = max(1, round(quantity / times))
+            options.append((f"{item.name} x{usual}"[:QUICK_REPLY_LABEL_MAX], f"點餐 {item.name} {usual}"))
+    return options
+
+@command("常點", exact=True)
+def favorites(ctx):
+    meal_type = ctx.meal_type
+    if not meal_type:
+        return text_reply("目前已超過所有點餐截止時間。")
+    restaurant_id = ctx.today_restaurant_id(meal_type)
+    if not restaurant_id:
+        return text_reply(f"請先設定今日{meal_type}餐廳。")
+    restaurant_name = ctx.catalogue.restaurants[restaurant_id].name
+    options = favorite_options(ctx, restaurant_id)
+    if not options:
+        return text_reply(f"你還沒在 {restaurant_name} 點過餐，輸入「吃啥」看今日菜單。")
+    return text_reply(f"你在 {restaurant_name} 常點的品項，點一下就能下單：", options)
+
+
+# --- 搜尋：跨餐廳找品項，結果附品項編號可直接點 ---
+@command("搜尋")
+def search(ctx):
+    args = ctx.args
+    page = 1
+    if len(args) >= 2 and args[-1].isdigit():
+        page = max(1, int(args[-1]))
+        args = args[:-1]
+    if not args:
+        return text_reply("請輸入：搜尋 關鍵字（例如：搜尋 珍珠奶茶）")
+    query = " ".join(args)
+    ids, has_next = search_items(ctx.conn, query, page)
+    items = [ctx.catalogue.items[i] for i in ids if i in ctx.catalogue.items]
+    if not items:
+        return text_reply(f"找不到符合「{query}」的品項。" if page == 1 else f"「{query}」沒有更多結果了。")
+    lines = [f"搜尋「{query}」結果（第{page}頁）："]
+    for item in items:
+        lines.append(f"[{item.code}] {item.name} ${item.price}（{ctx.catalogue.restaurant_of(item).name}）")
+    lines.append("\n輸入品項編號即可點餐")
+    # 品項按鈕送出 4 碼 code，直接進入原本的點餐流程
+    options = [(f"{item.code} {item.name}"[:QUICK_REPLY_LABEL_MAX], item.code) for item in items]
+    if page > 1:
+        options.append(("上一頁", f"搜尋 {query} {page-1}"))
+    if has_next:
+        options.append(("下一頁", f"搜尋 {query} {page+1}"))
+    return text_reply("\n".join(lines), options)
+
+
+# --- 沒有對應指令：quick reply 流程 -> 4 碼品項 code -> 原樣回覆 ---
+def fallback(ctx):
+    state = pending_orders.get(ctx.conn, ctx.session_key)
+    if state:
+        message = continue_pending(ctx, state)
+        if message:
+            ctx.command = f"pending_{state.step}"
+            return message
+    if ITEM_CODE_RE.fullmatch(ctx.text):
+        ctx.command = "select_item_code"
+        return select_item_code(ctx)
+    ctx.command = "echo"
+    return text_reply(f"你說了：{ctx.text}")
+
+
+def continue_pending(ctx, state):
+    # 回傳 None 代表這則訊息不是目前步驟預期的回覆
+    text = ctx.text
+    if state.step == "food_qty" and text in QUANTITY_CHOICES:
+        pending_orders.delete(ctx.conn, ctx.session_key)
+        return finish_food_order(ctx, state, int(text))
+    if state.step == "sweetness" and text.startswith("甜度"):
+        pending_orders.set(ctx.conn, ctx.session_key, state._replace(sweetness=text.replace("甜度", ""), step="ice"))
+        return text_reply("請選擇冰塊：", [(str(opt), f"冰塊{opt}") for opt in SUGAR_ICE_OPTIONS])
+    if state.step == "ice" and text.startswith("冰塊"):
+        pending_orders.set(ctx.conn, ctx.session_key, state._replace(ice=text.replace("冰塊", ""), step="drink_qty"))
+        return text_reply("請選擇數量：", [(f"{i}杯", str(i)) for i in range(1, 6)])
+    if state.step == "drink_qty" and text in QUANTITY_CHOICES:
+        pending_orders.delete(ctx.conn, ctx.session_key)
+        return finish_drink_order(ctx, state, int(text))
+    return None
+
+
+def finish_food_order(ctx, state, quantity):
+    meal_type = ctx.meal_type
+    if not meal_type:
+        return text_reply("目前已超過所有點餐截止時間。")
+    # 檢查今日餐廳
+    if not ctx.today_restaurant_id(meal_type):
+        return text_reply(f"請先設定今日{meal_type}餐廳。")
+    item = ctx.catalogue.items.get(state.menu_item_id)
+    if not item:
+        return text_reply("找不到此品項，請重新輸入編號。")
+    ctx.save_order(meal_type, [(item, quantity)])
+    return text_reply(f"已為你登記：[{item.code}] {item.name} ${item.price} x{quantity}（{meal_type}）")
+
+
+def finish_drink_order(ctx, state, quantity):
+    item = ctx.catalogue.items.get(state.menu_item_id)
+    if not item:
+        return text_reply("找不到此品項，請重新輸入編號。")
+    meal_type = ctx.meal_type
+    if not meal_type:
+        return text_reply("目前已超過所有點餐截止時間。")
+    # 檢查今日餐廳
+    if ctx.today_restaurant_id(meal_type) != item.restaurant_id:
+        return text_reply(f"請先設定今日{meal_type}餐廳為 {ctx.catalogue.restaurant_of(item).name}。")
+    ctx.save_order(meal_type, [(item, quantity)])
+    return text_reply(f"已為你登記：[{item.id}] {item.name} 甜度:{state.sweetness} 冰塊:{state.ice} x{quantity}（{meal_type}）")
+
+
+# --- 輸入 4 碼品項 code，回覆 quick reply ---
+def select_item_code(ctx):
+    item = ctx.catalogue.by_code.get(ctx.text.upper())
+    if not item:
+        return text_reply(f"找不到此品項編號：{ctx.text}")
+    # 判斷是否為飲料店
+    if is_drink_shop(ctx.catalogue.restaurant_of(item).name):
+        # 飲料流程：先記錄品項，回覆甜度 quick reply
+        pending_orders.set(ctx.conn, ctx.session_key, PendingOrder(item.id, "sweetness"))
+        return text_reply(f"你選擇了 [{item.code}] {item.name} (${item.price})\n請選擇甜度：",
+                          [(str(opt), f"甜度{opt}") for opt in SUGAR_ICE_OPTIONS])
+    # 一般餐點流程：直接進入份數 quick reply
+    pending_orders.set(ctx.conn, ctx.session_key, PendingOrder(item.id, "food_qty"))
+    return text_reply(f"你選擇了 [{item.code}] {item.name} (${item.price})\n請選擇需要幾份：",
+                      [(f"{i}份", str(i)) for i in range(1, 6)])
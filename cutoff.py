@@ -0,0 +1,96 @@
+import datetime
+import logging
+import os
+import threading
+
+from catalogue import get_catalogue
+from commands import MEAL_WINDOWS
+from models import get_db
+from order_writer import order_writer
+from orders import freeze_meal
+
+logger = logging.getLogger(__name__)
+
+# 行程內的截止排程：每到 MEAL_WINDOWS 的截止時間就凍結該餐的訂單並產生最終報表
+CUTOFF_SCHEDULER = os.getenv('CUTOFF_SCHEDULER', '1') == '1'
+
+
+def next_cutoff(now, windows=MEAL_WINDOWS):
+    # 回傳下一個 (截止時間 datetime, 餐別)
+    for deadline, meal_type in windows:
+        at = datetime.datetime.combine(now.date(), deadline)
+        if at > now:
+            return at, meal_type
+    deadline, meal_type = windows[0]
+    return datetime.datetime.combine(now.date() + datetime.timedelta(days=1), deadline), meal_type
+
+
+def freeze(date, meal_type):
+    # 多個 worker 都會觸發，只有第一個真的寫入；其餘只更新本行程的截止清單
+    conn = get_db()
+    try:
+        catalogue = get_catalogue(conn)
+        names = {rid: r.name for rid, r in catalogue.restaurants.items()}
+        created = freeze_meal(conn, date, meal_type, names)
+    finally:
+        conn.close()
+    order_writer.close_meal(date, meal_type)
+    if created:
+        logger.info('%s %s 已截止，報表已產生', date, meal_type)
+    return created
+
+
+class CutoffScheduler:
+    def __init__(self, windows=MEAL_WINDOWS, clock=datetime.datetime.now):
+        self.windows = windows
+        self.clock = clock
+        self.thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        # gunicorn fork 之後要在子行程重新啟動
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self.thread = threading.Thread(target=self._run, name='cutoff-scheduler', daemon=True)
+            self.thread.start()
+
+    def catch_up(self):
+        # 啟動時補上今天已過截止時間、但還沒凍結的餐別（例如重新部署時剛好跨過截止）
+        now = self.clock()
+        for deadline, meal_type in self.windows:
+            if datetime.datetime.combine(now.date(), deadline) <= now:
+                freeze(now.date().isoformat(), meal_type)
+
+    def _run(self):
+        try:
+            self.catch_up()
+        except Exception:
+            logger.exception('補截止失敗')
+        while True:
+            at, meal_type = next_cutoff(self.clock(), self.windows)
+            # 時鐘可能被調整，最多睡一分鐘就重新計算
+            while True:
+                remaining = (at - self.clock()).total_seconds()
+                if remaining <= 0:
+                    break
+                if self._stop.wait(min(remaining, 60)):
+                    return
+            try:
+                freeze(at.date().isoformat(), meal_type)
+            except Exception:
+                logger.exception('%s %s 截止處理失敗', at.date(), meal_type)
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self.thread.join(5)
+        self._pid = None
+
+
+cutoff_scheduler = CutoffScheduler()
@@ -0,0 +1,20 @@
+# 每位使用者在各店家的常點品項，與 order_record 在同一個交易內累加
+
+TOP_FAVORITES_SQL = '''SELECT f.menu_item_id, f.times, f.quantity
+                       FROM user u JOIN user_favorite f ON f.user_id = u.id
+                       WHERE u.line_user_id=? AND f.restaurant_id=?
+                       ORDER BY f.times DESC, f.last_date DESC LIMIT ?'''
+
+
+def record_favorite(conn, user_db_id, date, item, quantity):
+    conn.execute('''INSERT INTO user_favorite (user_id, restaurant_id, menu_item_id, times, quantity, last_date)
+                    VALUES (?, ?, ?, 1, ?, ?)
+                    ON CONFLICT (user_id, restaurant_id, menu_item_id) DO UPDATE SET
+                        times = times + 1, quantity = quantity + excluded.quantity,
+                        last_date = max(last_date, excluded.last_date)''',
+                 (user_db_id, item.restaurant_id, item.id, quantity, date))
+
+
+def top_favorites(conn, line_user_id, restaurant_id, limit=5):
+    # 回傳 [(menu_item_id, 點過幾次, 累計份數)]，點最多次的在前
+    return conn.execute(TOP_FAVORITES_SQL, (line_user_id, restaurant_id, limit)).fetchall()
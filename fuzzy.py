@@ -0,0 +1,49 @@
+import re
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize(text):
+    return _SPACE_RE.sub('', text).lower()
+
+
+def bigrams(text):
+    # 中文品名以相鄰兩字為單位；單一字元就用本身
+    text = normalize(text)
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class NgramIndex:
+    # 單一餐廳的品名 bigram 反向索引，查詢只看有共同 bigram 的品項
+    def __init__(self, items):
+        self.items = list(items)
+        self.postings = {}
+        self.sizes = []
+        self.names = []
+        for idx, item in enumerate(self.items):
+            grams = bigrams(item.name)
+            self.sizes.append(len(grams))
+            self.names.append(normalize(item.name))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(idx)
+
+    def search(self, query, limit=5):
+        # 依 Dice 係數排序，品名包含整個查詢字串的優先
+        grams = bigrams(query)
+        if not grams:
+            return []
+        hits = {}
+        for gram in grams:
+            for idx in self.postings.get(gram, ()):
+                hits[idx] = hits.get(idx, 0) + 1
+        needle = normalize(query)
+        scored = []
+        for idx, common in hits.items():
+            score = 2.0 * common / (len(grams) + self.sizes[idx])
+            if needle in self.names[idx]:
+                score += 1.0
+            scored.append((-score, len(self.names[idx]), idx))
+        scored.sort()
+        return [(-neg, self.items[idx]) for neg, _, idx in scored[:limit]]
@@ -1,122 +1,210 @@
-import re
+import hashlib
+import json
 import sqlite3
-from models import get_db, init_db
+import sys
+from models import get_db, init_db, bump_menu_generation
+from menu_parser import read_shops
+from picker import bump_picker_generation
+from search import refresh_search_index
 
 MENU_FILE = 'menu.md'
 DRINK_FILE = 'drink.md'
 
 def parse_menu():
-    with open(MENU_FILE, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    restaurants = []
-    current_restaurant = None
-    current_category = None
-    for line in lines:
-        line = line.strip()
-        if line.startswith('# ') and '餐廳菜單' in line:
-            current_restaurant = line.replace('# ', '').replace(' 餐廳菜單', '').strip()
-            restaurants.append({'name': current_restaurant, 'categories': []})
-        elif line.startswith('## '):
-            current_category = line.replace('## ', '').strip()
-            if current_restaurant:
-                restaurants[-1]['categories'].append({'name': current_category, 'items': []})
-        elif line.startswith('- '):
-            m = re.match(r'- (.+?)\s*[.。．…]*\s*\$([0-9]+)(/\S+)?', line)
-            if m and current_restaurant and current_category:
-                item_name = m.group(1).strip()
-                price = int(m.group(2))
-                note = m.group(3).strip() if m.group(3) else None
-                restaurants[-1]['categories'][-1]['items'].append({'name': item_name, 'price': price, 'note': note})
-    return restaurants
+    return read_shops(MENU_FILE)
 
 def parse_drink():
-    with open(DRINK_FILE, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    drink_shops = []
-    current_shop = None
-    current_category = None
-    for line in lines:
-        line = line.strip()
-        if line.startswith('# ') and '飲料店菜單' in line:
-            current_shop = line.replace('# ', '').replace(' 飲料店菜單', '').strip()
-            drink_shops.append({'name': current_shop, 'categories': []})
-        elif line.startswith('## '):
-            current_category = line.replace('## ', '').strip()
-            if current_shop:
-                drink_shops[-1]['categories'].append({'name': current_category, 'items': []})
-        elif line.startswith('- '):
-            m = re.match(r'- (.+?)\s*[.。．…]*\s*([0-9]+)(/\S+)?', line)
-            if m and current_shop and current_category:
-                item_name = m.group(1).strip()
-                price = int(m.group(2))
-                note = m.group(3).strip() if m.group(3) else None
-                drink_shops[-1]['categories'][-1]['items'].append({'name': item_name, 'price': price, 'note': note})
-    return drink_shops
+    return read_shops(DRINK_FILE)
 
 def gen_alpha2(n):
     return chr(65 + n // 26) + chr(65 + n % 26)
 
-def clear_tables():
-    conn = get_db()
+def block_hash(block):
+    # 餐廳或分類區塊內容的雜湊，內容沒變就整塊略過
+    return hashlib.sha1(json.dumps(block, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def restaurant_block(shop, shop_type):
+    return {'type': shop_type, 'categories': shop['categories']}
+
+def load_shops():
+    return [(shop, '餐廳') for shop in parse_menu()] + [(shop, '飲料店') for shop in parse_drink()]
+
+def clear_tables(conn):
+    # 由訂單 / 菜單衍生的表也一起清掉，不留下指向舊 id 的統計、常點、報表與點餐流程
+    # meal_cutoff 保留：已截止的餐別重新匯入後仍不接受點餐
     c = conn.cursor()
+    c.execute('DELETE FROM order_summary')
+    c.execute('DELETE FROM order_summary_text')
+    c.execute('DELETE FROM meal_report')
+    c.execute('DELETE FROM user_favorite')
+    c.execute('DELETE FROM restaurant_stats')
+    c.execute('DELETE FROM pending_order')
     c.execute('DELETE FROM order_record')
     c.execute('DELETE FROM today_restaurant')
     c.execute('DELETE FROM user')
     c.execute('DELETE FROM menu_item')
     c.execute('DELETE FROM menu_category')
     c.execute('DELETE FROM restaurant')
-    conn.commit()
-    conn.close()
+    # 各 worker 的隨便吃 / 隨便喝抽樣表要重新讀取
+    bump_picker_generation(conn)
 
-def import_all():
-    init_db()
-    clear_tables()
-    menu_restaurants = parse_menu()
-    drink_shops = parse_drink()
-    # 插入餐廳
-    conn = get_db()
-    c = conn.cursor()
-    for shop in menu_restaurants:
-        c.execute('INSERT INTO restaurant (name, type) VALUES (?, ?)', (shop['name'], '餐廳'))
-    for shop in drink_shops:
-        c.execute('INSERT INTO restaurant (name, type) VALUES (?, ?)', (shop['name'], '飲料店'))
-    conn.commit()
-    # 分配雙字母 code
-    c.execute('SELECT id FROM restaurant ORDER BY id')
-    ids = [row['id'] for row in c.fetchall()]
-    for idx, rid in enumerate(ids):
-        code = gen_alpha2(idx)
-        c.execute('UPDATE restaurant SET code=? WHERE id=?', (code, rid))
-    conn.commit()
-    # 重新查一次 name->(id,code)
-    c.execute('SELECT id, name, code FROM restaurant')
-    shop_map = {row['name']: (row['id'], row['code']) for row in c.fetchall()}
-    # 插入所有品項
-    for shop in menu_restaurants:
-        shop_id, shop_code = shop_map[shop['name']]
-        item_counter = 1
-        for cat in shop['categories']:
-            c.execute('INSERT INTO menu_category (restaurant_id, name) VALUES (?, ?)', (shop_id, cat['name']))
-            category_id = c.lastrowid
-            for item in cat['items']:
-                code = f"{shop_code}{str(item_counter).zfill(2)}"
-                c.execute('INSERT INTO menu_item (category_id, name, price, note, code) VALUES (?, ?, ?, ?, ?)',
-                          (category_id, item['name'], item['price'], item['note'], code))
-                item_counter += 1
-    for shop in drink_shops:
-        shop_id, shop_code = shop_map[shop['name']]
+def next_id(conn, table):
+    # 沿用 AUTOINCREMENT 的流水號，重新匯入後不會重複使用舊 id
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name=?', (table,)).fetchone()
+    return (row[0] if row else 0) + 1
+
+def build_rows(shops, restaurant_id, category_id, item_id):
+    # shops: [(店家 dict, type)]，在 Python 端先分配好 id 與 code
+    restaurants, categories, items = [], [], []
+    for idx, (shop, shop_type) in enumerate(shops):
+        shop_code = gen_alpha2(idx)
+        restaurants.append((restaurant_id, shop['name'], shop_code, shop_type,
+                            block_hash(restaurant_block(shop, shop_type))))
         item_counter = 1
         for cat in shop['categories']:
-            c.execute('INSERT INTO menu_category (restaurant_id, name) VALUES (?, ?)', (shop_id, cat['name']))
-            category_id = c.lastrowid
+            categories.append((category_id, restaurant_id, cat['name'], block_hash(cat)))
             for item in cat['items']:
                 code = f"{shop_code}{str(item_counter).zfill(2)}"
-                c.execute('INSERT INTO menu_item (category_id, name, price, note, code) VALUES (?, ?, ?, ?, ?)',
-                          (category_id, item['name'], item['price'], item['note'], code))
+                items.append((item_id, category_id, item['name'], item['price'], item['note'], code))
+                item_id += 1
                 item_counter += 1
-    conn.commit()
-    conn.close()
+            category_id += 1
+        restaurant_id += 1
+    return restaurants, categories, items
+
+def import_all():
+    init_db()
+    shops = load_shops()
+    conn = get_db()
+    # 整個重新匯入在同一個交易內完成，bot 只會看到舊菜單或新菜單
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        restaurants, categories, items = build_rows(
+            shops, next_id(conn, 'restaurant'), next_id(conn, 'menu_category'), next_id(conn, 'menu_item'))
+        clear_tables(conn)
+        conn.executemany('INSERT INTO restaurant (id, name, code, type, block_hash) VALUES (?, ?, ?, ?, ?)', restaurants)
+        conn.executemany('INSERT INTO menu_category (id, restaurant_id, name, block_hash) VALUES (?, ?, ?, ?)', categories)
+        conn.executemany('INSERT INTO menu_item (id, category_id, name, price, note, code) VALUES (?, ?, ?, ?, ?, ?)', items)
+        refresh_search_index(conn)
+        bump_menu_generation(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def item_keys(cat):
+    # 同一分類內可能有同名品項（不同尺寸），以 (分類, 品名, 第幾個) 對應
+    seen = {}
+    for item in cat['items']:
+        n = seen.get(item['name'], 0)
+        seen[item['name']] = n + 1
+        yield (cat['name'], item['name'], n), item
+
+def sync_restaurant(conn, restaurant_id, rest_code, shop, stats):
+    categories = {row['name']: row for row in conn.execute(
+        'SELECT id, name, active, block_hash FROM menu_category WHERE restaurant_id=?', (restaurant_id,))}
+    items = {}
+    max_no = 0
+    for row in conn.execute('''SELECT mi.id, mi.code, mi.name, mi.price, mi.note, mi.active, mc.name as category
+                               FROM menu_item mi JOIN menu_category mc ON mi.category_id = mc.id
+                               WHERE mc.restaurant_id=? ORDER BY mi.id''', (restaurant_id,)):
+        n = 0
+        while (row['category'], row['name'], n) in items:
+            n += 1
+        items[(row['category'], row['name'], n)] = row
+        if row['code'] and row['code'][2:].isdigit():
+            max_no = max(max_no, int(row['code'][2:]))
+    seen_categories, seen_items = set(), set()
+    for cat in shop['categories']:
+        h = block_hash(cat)
+        seen_categories.add(cat['name'])
+        row = categories.get(cat['name'])
+        if row is None:
+            cur = conn.execute('INSERT INTO menu_category (restaurant_id, name, block_hash) VALUES (?, ?, ?)',
+                               (restaurant_id, cat['name'], h))
+            category_id = cur.lastrowid
+            stats['categories'] += 1
+        else:
+            category_id = row['id']
+            if row['active'] and row['block_hash'] == h:
+                seen_items.update(key for key, _ in item_keys(cat))
+                continue
+            conn.execute('UPDATE menu_category SET active=1, block_hash=? WHERE id=?', (h, category_id))
+            stats['categories'] += 1
+        for key, item in item_keys(cat):
+            seen_items.add(key)
+            old = items.get(key)
+            if old is None:
+                # 新品項接在該餐廳最大的編號後面，既有 code 永遠不變
+                max_no += 1
+                conn.execute('INSERT INTO menu_item (category_id, name, price, note, code) VALUES (?, ?, ?, ?, ?)',
+                             (category_id, item['name'], item['price'], item['note'], f"{rest_code}{str(max_no).zfill(2)}"))
+                stats['inserted'] += 1
+            elif (old['price'], old['note'], old['active']) != (item['price'], item['note'], 1):
+                conn.execute('UPDATE menu_item SET price=?, note=?, active=1 WHERE id=?',
+                             (item['price'], item['note'], old['id']))
+                stats['updated'] += 1
+    gone = [(row['id'],) for key, row in items.items() if key not in seen_items and row['active']]
+    conn.executemany('UPDATE menu_item SET active=0 WHERE id=?', gone)
+    stats['deactivated'] += len(gone)
+    conn.executemany('UPDATE menu_category SET active=0 WHERE id=?',
+                     [(row['id'],) for name, row in categories.items() if name not in seen_categories and row['active']])
+
+def import_incremental():
+    # 只套用 menu.md / drink.md 有變動的部分；不動點餐紀錄、使用者與今日餐廳
+    init_db()
+    shops = load_shops()
+    hashes = {shop['name']: (shop_type, block_hash(restaurant_block(shop, shop_type))) for shop, shop_type in shops}
+    stats = {'restaurants': 0, 'categories': 0, 'inserted': 0, 'updated': 0, 'deactivated': 0}
+    conn = get_db()
+    try:
+        current = {row['name']: (row['type'], row['block_hash']) for row in
+                   conn.execute('SELECT name, type, block_hash FROM restaurant WHERE active=1')}
+        if current == hashes:
+            return stats
+        conn.execute('BEGIN IMMEDIATE')
+        existing = {row['name']: row for row in conn.execute('SELECT id, name, code, type, active, block_hash FROM restaurant')}
+        used_codes = {row['code'] for row in existing.values()}
+        touched = []
+        for shop, shop_type in shops:
+            h = hashes[shop['name']][1]
+            row = existing.get(shop['name'])
+            if row is None:
+                rest_code = next(gen_alpha2(n) for n in range(26 * 26) if gen_alpha2(n) not in used_codes)
+                used_codes.add(rest_code)
+                cur = conn.execute('INSERT INTO restaurant (name, code, type, block_hash) VALUES (?, ?, ?, ?)',
+                                   (shop['name'], rest_code, shop_type, h))
+                restaurant_id = cur.lastrowid
+            elif row['active'] and row['block_hash'] == h and row['type'] == shop_type:
+                continue
+            else:
+                restaurant_id, rest_code = row['id'], row['code']
+                conn.execute('UPDATE restaurant SET type=?, active=1, block_hash=? WHERE id=?',
+                             (shop_type, h, restaurant_id))
+            stats['restaurants'] += 1
+            touched.append(restaurant_id)
+            sync_restaurant(conn, restaurant_id, rest_code, shop, stats)
+        gone = [(row['id'],) for name, row in existing.items() if name not in hashes and row['active']]
+        conn.executemany('UPDATE restaurant SET active=0 WHERE id=?', gone)
+        stats['restaurants'] += len(gone)
+        # 只重建有變動的餐廳的搜尋索引
+        refresh_search_index(conn, touched + [rid for (rid,) in gone])
+        bump_menu_generation(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return stats
 
 if __name__ == '__main__':
-    import_all()
-    print('menu.md + drink.md 已成功合併匯入資料庫，所有 code 已正確分配！') 
\ No newline at end of file
+    if '--incremental' in sys.argv[1:]:
+        stats = import_incremental()
+        print(f"增量匯入完成：餐廳 {stats['restaurants']}、分類 {stats['categories']}、"
+              f"新增 {stats['inserted']}、更新 {stats['updated']}、下架 {stats['deactivated']}")
+    else:
+        import_all()
+        print('menu.md + drink.md 已成功合併匯入資料庫，所有 code 已正確分配！')
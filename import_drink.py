@@ -1,34 +1,12 @@
-import re
 import sqlite3
-from models import get_db, init_db
+from models import get_db, init_db, bump_menu_generation
+from menu_parser import read_shops
+from search import refresh_search_index
 
 DRINK_FILE = 'drink.md'
 
 def parse_drink():
-    with open(DRINK_FILE, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
-    drink_shops = []
-    current_shop = None
-    current_category = None
-    for line in lines:
-        line = line.strip()
-        if line.startswith('# ') and '飲料店菜單' in line:
-            current_shop = line.replace('# ', '').replace(' 飲料店菜單', '').strip()
-            drink_shops.append({'name': current_shop, 'categories': []})
-        elif line.startswith('## '):
-            current_category = line.replace('## ', '').strip()
-            if current_shop:
-                drink_shops[-1]['categories'].append({'name': current_category, 'items': []})
-        elif line.startswith('- '):
-            # 品項與價格
-            m = re.match(r'- (.+?)\s*[.。．…]*\s*([0-9]+)(/\S+)?', line)
-            if m and current_shop and current_category:
-                item_name = m.group(1).strip()
-                price = int(m.group(2))
-                note = m.group(3).strip() if m.group(3) else None
-                drink_shops[-1]['categories'][-1]['items'].append({'name': item_name, 'price': price, 'note': note})
-    return drink_shops
+    return read_shops(DRINK_FILE)
 
 def get_drinkshop_prefix(name):
     # 取飲料店拼音首字母，特殊例外可自行擴充
@@ -80,6 +58,8 @@ def import_to_db(drink_shops):
                 c.execute('INSERT INTO menu_item (category_id, name, price, note, code) VALUES (?, ?, ?, ?, ?)',
                           (category_id, item['name'], item['price'], item['note'], code))
                 item_counter += 1
+    refresh_search_index(conn)
+    bump_menu_generation(conn)
     conn.commit()
     conn.close()
 
@@ -1,34 +1,12 @@
-import re
 import sqlite3
-from models import get_db, init_db
+from models import get_db, init_db, bump_menu_generation
+from menu_parser import read_shops
+from search import refresh_search_index
 
 MENU_FILE = 'menu.md'
 
 def parse_menu():
-    with open(MENU_FILE, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
-    restaurants = []
-    current_restaurant = None
-    current_category = None
-    for line in lines:
-        line = line.strip()
-        if line.startswith('# ') and '餐廳菜單' in line:
-            current_restaurant = line.replace('# ', '').replace(' 餐廳菜單', '').strip()
-            restaurants.append({'name': current_restaurant, 'categories': []})
-        elif line.startswith('## '):
-            current_category = line.replace('## ', '').strip()
-            if current_restaurant:
-                restaurants[-1]['categories'].append({'name': current_category, 'items': []})
-        elif line.startswith('- '):
-            # 品項與價格
-            m = re.match(r'- (.+?)\s*[.。．…]*\s*\$([0-9]+)(/\S+)?', line)
-            if m and current_restaurant and current_category:
-                item_name = m.group(1).strip()
-                price = int(m.group(2))
-                note = m.group(3).strip() if m.group(3) else None
-                restaurants[-1]['categories'][-1]['items'].append({'name': item_name, 'price': price, 'note': note})
-    return restaurants
+    return read_shops(MENU_FILE)
 
 def get_restaurant_prefix(name):
     # 取餐廳拼音首字母，特殊例外可自行擴充
@@ -79,6 +57,8 @@ def import_to_db(restaurants):
                 c.execute('INSERT INTO menu_item (category_id, name, price, note, code) VALUES (?, ?, ?, ?, ?)',
                           (category_id, item['name'], item['price'], item['note'], code))
                 item_counter += 1
+    refresh_search_index(conn)
+    bump_menu_generation(conn)
     conn.commit()
     conn.close()
 
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from linebot import AsyncLineBotApi, LineBotApi
+from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient, AiohttpAsyncHttpResponse
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 對 LINE API 的連線設定：共用 keep-alive 連線池、逾時、重試與限流
+LINE_HTTP_POOL_SIZE = int(os.getenv('LINE_HTTP_POOL_SIZE', '16'))
+LINE_CONNECT_TIMEOUT = float(os.getenv('LINE_CONNECT_TIMEOUT', '3'))
+LINE_READ_TIMEOUT = float(os.getenv('LINE_READ_TIMEOUT', '5'))
+LINE_RETRIES = int(os.getenv('LINE_RETRIES', '3'))
+# 第 n 次重試等待 LINE_RETRY_BACKOFF * 2^n 秒（±50% 隨機），最多 LINE_RETRY_MAX_DELAY 秒
+LINE_RETRY_BACKOFF = float(os.getenv('LINE_RETRY_BACKOFF', '0.2'))
+LINE_RETRY_MAX_DELAY = float(os.getenv('LINE_RETRY_MAX_DELAY', '5'))
+# 每秒最多送出幾個請求；0 代表不限
+LINE_RATE_LIMIT = float(os.getenv('LINE_RATE_LIMIT', '100'))
+LINE_RATE_BURST = int(os.getenv('LINE_RATE_BURST', '50'))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+ENDPOINT_NAMES = (
+    (re.compile(r'/v2/bot/message/reply$'), 'reply_message'),
+    (re.compile(r'/v2/bot/message/push$'), 'push_message'),
+    (re.compile(r'/v2/bot/profile/[^/]+$'), 'get_profile'),
+    (re.compile(r'/v2/bot/group/[^/]+/member/[^/]+$'), 'get_group_member_profile'),
+)
+
+LINE_HTTP_RETRIES = metrics.Counter('bot_line_http_retries_total', 'LINE API 重試次數', ('endpoint',))
+
+
+def endpoint_name(url):
+    path = requests.utils.urlparse(url).path
+    for pattern, name in ENDPOINT_NAMES:
+        if pattern.search(path):
+            return name
+    return path
+
+
+class TokenBucket:
+    def __init__(self, rate=LINE_RATE_LIMIT, burst=LINE_RATE_BURST):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # 先扣一個 token，回傳要等待的秒數（不足時記為欠額，後來的人排在後面）
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class EndpointStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.throttled = 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'avg_ms': round(self.total / self.calls * 1000, 3) if self.calls else 0.0,
+            'max_ms': round(self.max * 1000, 3),
+            'throttled_ms': round(self.throttled * 1000, 3),
+        }
+
+
+_bucket = TokenBucket()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def line_api_stats():
+    with _stats_lock:
+        return {name: s.as_dict() for name, s in _stats.items()}
+
+
+def _record(name, elapsed, ok, retried, throttled):
+    with _stats_lock:
+        s = _stats.get(name)
+        if s is None:
+            s = _stats[name] = EndpointStats()
+        s.calls += 1
+        s.total += elapsed
+        s.max = max(s.max, elapsed)
+        s.throttled += throttled
+        if not ok:
+            s.errors += 1
+        if retried:
+            s.retries += 1
+
+
+def retry_delay(attempt, status=None, headers=None):
+    delay = LINE_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+    if status == 429:
+        try:
+            delay = max(delay, float(headers.get('Retry-After', 0)))
+        except ValueError:
+            pass
+    return min(delay, LINE_RETRY_MAX_DELAY)
+
+
+class PooledHttpClient(RequestsHttpClient):
+    # 給 LineBotApi 用的 http client：整個行程共用同一個 requests.Session
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+
+    def __init__(self, timeout=(LINE_CONNECT_TIMEOUT, LINE_READ_TIMEOUT), retries=LINE_RETRIES, bucket=None):
+        super().__init__(timeout)
+        self.retries = retries
+        self.bucket = bucket or _bucket
+
+    @classmethod
+    def session(cls):
+        # gunicorn fork 後重新建立，避免共用父行程的 socket
+        with cls._session_lock:
+            if cls._session is None or cls._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LINE_HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                cls._session, cls._session_pid = session, os.getpid()
+            return cls._session
+
+    def _request(self, method, url, timeout=None, **kwargs):
+        name = endpoint_name(url)
+        session = self.session()
+        for attempt in range(self.retries + 1):
+            throttled = self.bucket.acquire()
+            started = time.perf_counter()
+            response = error = None
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                # 連不上一定沒送出，可以重試
+                error = e
+            except requests.Timeout as e:
+                # 讀取逾時時 LINE 可能已收到；reply token 只能用一次，只有 GET 重試
+                if method != 'GET':
+                    _record(name, time.perf_counter() - started, False, attempt > 0, throttled)
+                    raise
+                error = e
+            ok = response is not None and response.status_code < 400
+            _record(name, time.perf_counter() - started, ok, attempt > 0, throttled)
+            if (error is None and response.status_code not in RETRY_STATUSES) or attempt == self.retries:
+                if error is not None:
+                    raise error
+                return RequestsHttpResponse(response)
+            status = response.status_code if response is not None else None
+            delay = retry_delay(attempt, status, response.headers if response is not None else None)
+            if response is not None:
+                response.close()
+            LINE_HTTP_RETRIES.inc(name)
+            logger.warning('LINE API %s 失敗（%s），%.2f 秒後重試', name, status or type(error).__name__, delay)
+            time.sleep(delay)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request('GET', url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request('POST', url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request('DELETE', url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request('PUT', url, timeout, headers=headers, data=data)
+
+
+def make_line_bot_api(channel_access_token, endpoint):
+    return LineBotApi(channel_access_token, endpoint=endpoint,
+                      timeout=(LINE_CONNECT_TIMEOUT, LINE_READ_TIMEOUT), http_client=PooledHttpClient)
+
+
+class AsyncPooledHttpClient(AiohttpAsyncHttpClient):
+    # asgi.py 用的非同步版本：重試、限流與統計規則和 PooledHttpClient 相同
+    def __init__(self, session, retries=LINE_RETRIES, bucket=None):
+        super().__init__(session, aiohttp.ClientTimeout(connect=LINE_CONNECT_TIMEOUT, sock_read=LINE_READ_TIMEOUT))
+        self.retries = retries
+        self.bucket = bucket or _bucket
+
+    async def _request(self, method, url, timeout=None, **kwargs):
+        name = endpoint_name(url)
+        for attempt in range(self.retries + 1):
+            throttled = self.bucket.reserve()
+            if throttled:
+                await asyncio.sleep(throttled)
+            started = time.perf_counter()
+            response = error = None
+            try:
+                response = await self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except aiohttp.ClientConnectorError as e:
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if method != 'GET':
+                    _record(name, time.perf_counter() - started, False, attempt > 0, throttled)
+                    raise
+                error = e
+            ok = response is not None and response.status < 400
+            _record(name, time.perf_counter() - started, ok, attempt > 0, throttled)
+            if (error is None and response.status not in RETRY_STATUSES) or attempt == self.retries:
+                if error is not None:
+                    raise error
+                return AiohttpAsyncHttpResponse(response)
+            status = response.status if response is not None else None
+            delay = retry_delay(attempt, status, response.headers if response is not None else None)
+            if response is not None:
+                response.release()
+            LINE_HTTP_RETRIES.inc(name)
+            logger.warning('LINE API %s 失敗（%s），%.2f 秒後重試', name, status or type(error).__name__, delay)
+            await asyncio.sleep(delay)
+
+    async def get(self, url, headers=None, params=None, timeout=None):
+        return await self._request('GET', url, timeout, headers=headers, params=params)
+
+    async def post(self, url, headers=None, data=None, timeout=None):
+        return await self._request('POST', url, timeout, headers=headers, data=data)
+
+    async def delete(self, url, headers=None, data=None, timeout=None):
+        return await self._request('DELETE', url, timeout, headers=headers, data=data)
+
+    async def put(self, url, headers=None, data=None, timeout=None):
+        return await self._request('PUT', url, timeout, headers=headers, data=data)
+
+
+def make_aiohttp_session():
+    # 需在 event loop 內建立；keep-alive 連線數上限同 LINE_HTTP_POOL_SIZE
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=LINE_HTTP_POOL_SIZE))
+
+
+def make_async_line_bot_api(channel_access_token, endpoint, session):
+    return AsyncLineBotApi(channel_access_token, AsyncPooledHttpClient(session), endpoint=endpoint)
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 壓測用的 LINE API 替身：回覆 / 推播 / 個人資料都回固定內容，延遲可調
+STUB_LATENCY_MS = float(os.getenv('STUB_LATENCY_MS', '50'))
+STUB_JITTER_MS = float(os.getenv('STUB_JITTER_MS', '20'))
+# 隨機回 500 / 429 的比例，用來測試重試
+STUB_FAIL_RATE = float(os.getenv('STUB_FAIL_RATE', '0'))
+
+PROFILE_PATH_RE = re.compile(r'/v2/bot/profile/([^/?]+)$')
+MESSAGE_PATHS = {'/v2/bot/message/reply': 'reply', '/v2/bot/message/push': 'push'}
+
+
+class LineStub:
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=STUB_LATENCY_MS, jitter_ms=STUB_JITTER_MS,
+                 fail_rate=STUB_FAIL_RATE):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='line-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _delay(self):
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _fail(self):
+        # 回傳要模擬的錯誤狀態碼，None 代表正常回應
+        if self.fail_rate and random.random() < self.fail_rate:
+            status = random.choice((429, 500))
+            self._count(f'status_{status}')
+            return status
+        return None
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # keep-alive 下標頭與本文分兩次寫出，不關 Nagle 會多出 ~40ms 延遲
+            disable_nagle_algorithm = True
+
+            def _send(self, status, payload, headers=()):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                kind = MESSAGE_PATHS.get(self.path)
+                if not kind:
+                    stub._count('not_found')
+                    return self._send(404, {'message': 'Not found'})
+                stub._delay()
+                if self._send_failure():
+                    return
+                stub._count(kind)
+                self._send(200, {})
+
+            def do_GET(self):
+                if self.path == '/stats':
+                    return self._send(200, stub.stats())
+                m = PROFILE_PATH_RE.match(self.path)
+                if not m:
+                    stub._count('not_found')
+                    return self._send(404, {'message': 'Not found'})
+                stub._delay()
+                if self._send_failure():
+                    return
+                stub._count('profile')
+                user_id = m.group(1)
+                self._send(200, {'userId': user_id, 'displayName': f'壓測{user_id[-4:]}'})
+
+            def _send_failure(self):
+                status = stub._fail()
+                if status is None:
+                    return False
+                headers = (('Retry-After', '0'),) if status == 429 else ()
+                self._send(status, {'message': 'stub failure'}, headers)
+                return True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本機 LINE API 替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=STUB_LATENCY_MS, help='每次呼叫的延遲（毫秒）')
+    parser.add_argument('--jitter', type=float, default=STUB_JITTER_MS, help='延遲的隨機浮動（毫秒）')
+    parser.add_argument('--fail-rate', type=float, default=STUB_FAIL_RATE, help='隨機回 429/500 的比例')
+    args = parser.parse_args()
+    stub = LineStub(args.host, args.port, args.latency, args.jitter, args.fail_rate)
+    print(f'LINE API 替身：{stub.url}（延遲 {args.latency}±{args.jitter}ms，GET /stats 看呼叫次數）')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,72 @@
+import logging
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# menu.md / drink.md 共用格式：
+#   # 店名 餐廳菜單 / # 店名 飲料店菜單 / # 店名 菜單
+#   ## 分類
+#   - 品名 .......... $價格[/單位]   （價格前的 $ 可省略）
+RESTAURANT_RE = re.compile(r'#\s+(.+?)\s+(?:餐廳|飲料店)?菜單\s*$')
+CATEGORY_RE = re.compile(r'##\s+(.+?)\s*$')
+ITEM_RE = re.compile(r'-\s+(.+?)(?:\s*[.。．…]+\s*|\s+)\$?([0-9]+)(/\S+)?\s*$')
+
+RestaurantRecord = namedtuple('RestaurantRecord', 'name line_no')
+CategoryRecord = namedtuple('CategoryRecord', 'name line_no')
+ItemRecord = namedtuple('ItemRecord', 'name price note line_no')
+
+
+def warn_malformed(path, line_no, line, reason):
+    logger.warning('%s:%d %s：%s', path, line_no, reason, line)
+
+
+def iter_menu(lines, path='<menu>', on_error=warn_malformed):
+    # 逐行讀取，依序產生餐廳 / 分類 / 品項紀錄，不會一次載入整個檔案
+    in_restaurant = in_category = False
+    for line_no, raw in enumerate(lines, 1):
+        line = raw.strip()
+        if line.startswith('## '):
+            m = CATEGORY_RE.match(line)
+            if not in_restaurant:
+                on_error(path, line_no, line, '分類不在任何店家之下')
+                continue
+            in_category = True
+            yield CategoryRecord(m.group(1), line_no)
+        elif line.startswith('# '):
+            m = RESTAURANT_RE.match(line)
+            if not m:
+                on_error(path, line_no, line, '無法辨識的店家標題')
+                # 後面的分類不能掛到上一家店
+                in_restaurant = in_category = False
+                continue
+            in_restaurant, in_category = True, False
+            yield RestaurantRecord(m.group(1), line_no)
+        elif line.startswith('- '):
+            m = ITEM_RE.match(line)
+            if not m:
+                on_error(path, line_no, line, '無法解析的品項')
+            elif not in_category:
+                on_error(path, line_no, line, '品項不在任何分類之下')
+            else:
+                note = m.group(3).strip() if m.group(3) else None
+                yield ItemRecord(m.group(1).strip(), int(m.group(2)), note, line_no)
+
+
+def iter_menu_file(path, on_error=warn_malformed):
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_menu(f, path, on_error)
+
+
+def read_shops(path, on_error=warn_malformed):
+    # 匯入程式使用的巢狀結構：[{'name', 'categories': [{'name', 'items': [...]}]}]
+    shops = []
+    for record in iter_menu_file(path, on_error):
+        if isinstance(record, RestaurantRecord):
+            shops.append({'name': record.name, 'categories': []})
+        elif isinstance(record, CategoryRecord):
+            shops[-1]['categories'].append({'name': record.name, 'items': []})
+        else:
+            shops[-1]['categories'][-1]['items'].append(
+                {'name': record.name, 'price': record.price, 'note': record.note})
+    return shops
@@ -0,0 +1,202 @@
+import bisect
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# 內建的 Prometheus 指標（純文字格式，不需額外套件）；METRICS_ENABLED=0 可關閉 SQL 計時
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # 沒有 label 的指標一開始就輸出 0
+        self._values = {} if self.labels else {(): 0}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [各 bucket 次數..., +Inf 次數, 總和]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[i] += 1
+            entry[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(entry) for labels, entry in self._values.items()}
+        names = self.labels + ('le',)
+        for labels, entry in sorted(values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry):
+                total += count
+                yield self.name + '_bucket' + _format_labels(names, labels + (bound,)), total
+            yield self.name + '_sum' + _format_labels(self.labels, labels), round(entry[-1], 6)
+            yield self.name + '_count' + _format_labels(self.labels, labels), total
+
+
+REQUESTS_IN_FLIGHT = Gauge('bot_http_requests_in_flight', '正在處理的 webhook 請求數')
+CALLBACK_SECONDS = Histogram('bot_callback_seconds', '/callback 處理時間')
+COMMAND_SECONDS = Histogram('bot_command_seconds', '各指令處理時間（不含回覆）', ('command',))
+COMMAND_ERRORS = Counter('bot_command_errors_total', '各指令發生例外的次數', ('command',))
+SQL_SECONDS = Histogram('bot_sql_seconds', 'SQL 執行到取完資料的時間', ('statement',))
+SQL_ROWS = Counter('bot_sql_rows_total', 'SQL 讀取或異動的筆數', ('statement',))
+LINE_API_SECONDS = Histogram('bot_line_api_seconds', '呼叫 LINE API 的時間', ('endpoint',))
+LINE_API_ERRORS = Counter('bot_line_api_errors_total', '呼叫 LINE API 失敗次數', ('endpoint',))
+
+
+@contextmanager
+def timer(histogram, *labels, errors=None):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc(*labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, *labels)
+
+
+@contextmanager
+def track_request():
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        with timer(CALLBACK_SECONDS):
+            yield
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+
+
+def line_api(endpoint):
+    return timer(LINE_API_SECONDS, endpoint, errors=LINE_API_ERRORS)
+
+
+# SQL 依「動作 + 主要資料表」分組，避免每條語句各自成為一個 label
+_SQL_TABLE_RE = re.compile(r'\b(?:FROM|INTO|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)', re.IGNORECASE)
+_sql_labels = {}
+
+
+def sql_label(sql):
+    label = _sql_labels.get(sql)
+    if label is None:
+        words = sql.split(None, 2)
+        verb = words[0].upper() if words else 'SQL'
+        if verb == 'UPDATE' and len(words) > 1:
+            table = words[1]
+        else:
+            m = _SQL_TABLE_RE.search(sql)
+            table = m.group(1) if m else ''
+        label = f'{verb} {table}'.strip()
+        if len(_sql_labels) < 1000:
+            _sql_labels[sql] = label
+    return label
+
+
+class TimedCursor:
+    # SELECT 的時間算到資料取完為止；其他語句執行完就記錄
+    def __init__(self, cursor, label, started):
+        self._cursor = cursor
+        self._label = label
+        self._started = started
+
+    def _done(self, rows):
+        if self._started is not None:
+            SQL_SECONDS.observe(time.perf_counter() - self._started, self._label)
+            SQL_ROWS.inc(self._label, amount=rows)
+            self._started = None
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._done(1 if row is not None else 0)
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._done(len(rows))
+        return rows
+
+    def __iter__(self):
+        count = 0
+        for row in self._cursor:
+            count += 1
+            yield row
+        self._done(count)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def timed_execute(method, sql, params):
+    started = time.perf_counter()
+    cursor = method(sql, params)
+    label = sql_label(sql)
+    if cursor.description is None:
+        SQL_SECONDS.observe(time.perf_counter() - started, label)
+        SQL_ROWS.inc(label, amount=max(cursor.rowcount, 0))
+        return cursor
+    return TimedCursor(cursor, label, started)
+
+
+def render(extra=None):
+    # extra: {前綴: stats dict}，數值欄位輸出成 gauge（例如連線池、webhook 佇列）
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(f'{name} {value}' for name, value in metric.samples())
+    for prefix, stats in (extra or {}).items():
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f'# TYPE {prefix}_{key} gauge')
+            lines.append(f'{prefix}_{key} {value}')
+    return '\n'.join(lines) + '\n'
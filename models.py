@@ -1,14 +1,185 @@
+import os
+import queue
 import sqlite3
+import threading
+import time
 
-DB_NAME = 'db.sqlite3'
+from metrics import METRICS_ENABLED, timed_execute
 
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
+# 壓測時可指向資料庫副本
+DB_NAME = os.getenv('DB_NAME', 'db.sqlite3')
+
+# 連線池設定
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+
+# 每條連線建立時只設定一次
+CONNECTION_PRAGMAS = (
+    # 要在切換 WAL（會寫入檔頭）之前設定，只對全新的空資料庫生效；既有資料庫由 python archive.py 手動轉換
+    'PRAGMA auto_vacuum=INCREMENTAL',
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+def connect(database=DB_NAME):
+    # 不經過連線池的獨立連線（連線池與 order writer 專用連線都用這個建立）
+    conn = sqlite3.connect(database, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
-    conn = get_db()
+
+class PooledConnection:
+    # 包裝 sqlite3.Connection：close() 只是歸還連線池，其餘操作原樣轉交
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(raw, name)
+
+    def _checked(self):
+        if self._raw is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return self._raw
+
+    # 開啟 METRICS_ENABLED 時記錄每條 SQL 的時間與筆數（/metrics）
+    def execute(self, sql, params=()):
+        if METRICS_ENABLED:
+            return timed_execute(self._checked().execute, sql, params)
+        return self._checked().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        if METRICS_ENABLED:
+            return timed_execute(self._checked().executemany, sql, seq_of_params)
+        return self._checked().executemany(sql, seq_of_params)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._raw.__exit__(*exc)
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.release(raw)
+
+    def __del__(self):
+        # 忘記 close() 時也要把連線還回池子
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, database, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.database = database
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # gunicorn fork 後不可沿用父行程的連線
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._checked_out = 0
+        self._acquires = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        return connect(self.database)
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._acquires += 1
+            try:
+                raw = self._idle.get_nowait()
+            except queue.Empty:
+                raw = None
+                if self._created < self.max_size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if raw is not None:
+                self._checked_out += 1
+                return raw
+        if create:
+            try:
+                raw = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            # 連線都被借走，等待歸還
+            started = time.monotonic()
+            try:
+                raw = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise sqlite3.OperationalError('database connection pool exhausted')
+            waited = time.monotonic() - started
+            with self._lock:
+                self._waits += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        with self._lock:
+            self._checked_out += 1
+        return raw
+
+    def release(self, raw):
+        # 歸還前把沒 commit 的交易 rollback，行為與原本 close() 相同
+        if raw.in_transaction:
+            raw.rollback()
+        with self._lock:
+            self._checked_out -= 1
+        self._idle.put(raw)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'created': self._created,
+                'checked_out': self._checked_out,
+                'idle': self._idle.qsize(),
+                'acquires': self._acquires,
+                'waits': self._waits,
+                'wait_avg_ms': round(self._wait_total / self._waits * 1000, 3) if self._waits else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+
+_pool = ConnectionPool(DB_NAME)
+
+def get_db():
+    return PooledConnection(_pool, _pool.acquire())
+
+def pool_stats():
+    return _pool.stats()
+
+def init_db(conn=None):
+    # 沒給連線時向連線池借（DB_NAME）；測試與 query_plans.py 傳入暫存資料庫的連線
+    borrowed = conn is None
+    if borrowed:
+        conn = get_db()
     c = conn.cursor()
     # 餐廳表
     c.execute('''
@@ -73,7 +244,271 @@ def init_db():
         )
     ''')
     conn.commit()
-    conn.close()
+    migrate(conn)
+    if borrowed:
+        conn.close()
+
+# 結構版本（PRAGMA user_version），新的變更請往後加一個版本
+MIGRATIONS = [
+    (1, (
+        # 統計：order_record 以 (date, meal_type) 篩選，覆蓋 join 與加總需要的欄位
+        'CREATE INDEX IF NOT EXISTS idx_order_record_date_meal ON order_record (date, meal_type, menu_item_id, user_id, quantity)',
+        # 4 碼品項 code 查詢
+        'CREATE INDEX IF NOT EXISTS idx_menu_item_code ON menu_item (code)',
+        # 菜單：分類 -> 品項
+        'CREATE INDEX IF NOT EXISTS idx_menu_item_category ON menu_item (category_id)',
+        # 菜單：餐廳 -> 分類
+        'CREATE INDEX IF NOT EXISTS idx_menu_category_restaurant ON menu_category (restaurant_id)',
+    )),
+    (2, (
+        # 共用設定值；menu_generation 由匯入程式遞增，讓各 worker 知道菜單要重新載入
+        '''CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )''',
+        "INSERT OR IGNORE INTO app_meta (key, value) VALUES ('menu_generation', 0)",
+    )),
+    (3, (
+        # 增量匯入：下架改為 active=0（保留 id 與 code 給舊的點餐紀錄），block_hash 用來略過沒變的區塊
+        'ALTER TABLE restaurant ADD COLUMN active INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE restaurant ADD COLUMN block_hash TEXT',
+        'ALTER TABLE menu_category ADD COLUMN active INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE menu_category ADD COLUMN block_hash TEXT',
+        'ALTER TABLE menu_item ADD COLUMN active INTEGER NOT NULL DEFAULT 1',
+    )),
+    (4, (
+        # 統計用的預先加總，與 order_record 在同一個交易內更新
+        '''CREATE TABLE IF NOT EXISTS order_summary (
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            menu_item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (date, meal_type, restaurant_id, user_id, menu_item_id)
+        ) WITHOUT ROWID''',
+        # 已產生的統計文字，有新訂單就刪除
+        '''CREATE TABLE IF NOT EXISTS order_summary_text (
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (date, meal_type, restaurant_id)
+        ) WITHOUT ROWID''',
+        '''INSERT OR IGNORE INTO order_summary (date, meal_type, restaurant_id, user_id, menu_item_id, quantity, amount)
+           SELECT orr.date, orr.meal_type, mc.restaurant_id, orr.user_id, orr.menu_item_id,
+                  SUM(orr.quantity), SUM(orr.quantity * mi.price)
+           FROM order_record orr
+           JOIN menu_item mi ON orr.menu_item_id = mi.id
+           JOIN menu_category mc ON mi.category_id = mc.id
+           GROUP BY orr.date, orr.meal_type, mc.restaurant_id, orr.user_id, orr.menu_item_id''',
+    )),
+    (5, (
+        # quick reply 點餐流程暫存，讓不同 worker 接到的下一步也能繼續
+        '''CREATE TABLE IF NOT EXISTS pending_order (
+            line_user_id TEXT PRIMARY KEY,
+            menu_item_id INTEGER NOT NULL,
+            step TEXT NOT NULL,
+            sweetness TEXT,
+            ice TEXT,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_pending_order_expires ON pending_order (expires_at)',
+    )),
+    (6, (
+        # 搜尋用全文索引，rowid 對應 menu_item.id；由匯入程式同步
+        "CREATE VIRTUAL TABLE IF NOT EXISTS menu_search USING fts5(name, category, restaurant, tokenize='trigram')",
+        '''INSERT INTO menu_search (rowid, name, category, restaurant)
+           SELECT mi.id, mi.name, mc.name, r.name
+           FROM menu_item mi
+           JOIN menu_category mc ON mi.category_id = mc.id
+           JOIN restaurant r ON mc.restaurant_id = r.id
+           WHERE mi.active=1 AND mc.active=1 AND r.active=1''',
+    )),
+    (7, (
+        # 隨便吃 / 隨便喝的權重來源：最近被選的日期、被選次數、累計點餐份數
+        '''CREATE TABLE IF NOT EXISTS restaurant_stats (
+            restaurant_id INTEGER PRIMARY KEY,
+            last_picked TEXT,
+            picks INTEGER NOT NULL DEFAULT 0,
+            orders INTEGER NOT NULL DEFAULT 0
+        )''',
+        '''INSERT INTO restaurant_stats (restaurant_id, last_picked, picks)
+           SELECT restaurant_id, MAX(date), COUNT(*) FROM today_restaurant GROUP BY restaurant_id''',
+        '''INSERT INTO restaurant_stats (restaurant_id, orders)
+           SELECT restaurant_id, SUM(quantity) FROM order_summary WHERE true GROUP BY restaurant_id
+           ON CONFLICT(restaurant_id) DO UPDATE SET orders = excluded.orders''',
+        "INSERT OR IGNORE INTO app_meta (key, value) VALUES ('picker_generation', 0)",
+    )),
+    (8, (
+        # 常點：每位使用者在各店家點過的品項次數與份數
+        '''CREATE TABLE IF NOT EXISTS user_favorite (
+            user_id INTEGER NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            menu_item_id INTEGER NOT NULL,
+            times INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            last_date TEXT NOT NULL,
+            PRIMARY KEY (user_id, restaurant_id, menu_item_id)
+        ) WITHOUT ROWID''',
+        # 常點排行：一次索引查詢依次數取前幾名
+        'CREATE INDEX IF NOT EXISTS idx_user_favorite_rank ON user_favorite (user_id, restaurant_id, times DESC, last_date DESC)',
+        '''INSERT INTO user_favorite (user_id, restaurant_id, menu_item_id, times, quantity, last_date)
+           SELECT orr.user_id, mc.restaurant_id, orr.menu_item_id, COUNT(*), SUM(orr.quantity), MAX(orr.date)
+           FROM order_record orr
+           JOIN menu_item mi ON orr.menu_item_id = mi.id
+           JOIN menu_category mc ON mi.category_id = mc.id
+           GROUP BY orr.user_id, mc.restaurant_id, orr.menu_item_id''',
+    )),
+    (9, (
+        # 截止時間到就凍結該餐：meal_cutoff 標記已截止，meal_report 存各店家的最終報表
+        '''CREATE TABLE IF NOT EXISTS meal_cutoff (
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            frozen_at REAL NOT NULL,
+            PRIMARY KEY (date, meal_type)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS meal_report (
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (date, meal_type, restaurant_id)
+        ) WITHOUT ROWID''',
+    )),
+    (10, (
+        # 統計已改讀 order_summary，order_record 只剩對帳匯出會掃描：
+        # 改成 (date, meal_type, user_id) 開頭的覆蓋索引，日期區間掃描不需回表也不需排序
+        'DROP INDEX IF EXISTS idx_order_record_date_meal',
+        'CREATE INDEX IF NOT EXISTS idx_order_record_date_user ON order_record (date, meal_type, user_id, menu_item_id, quantity)',
+    )),
+    (11, (
+        # 多群組：tenant 為 LINE 群組 / 聊天室 id，一對一聊天為 ''（既有資料都歸在 ''）
+        # 有 UNIQUE / PRIMARY KEY 的表要重建，讓 tenant 成為索引的第一欄
+        '''CREATE TABLE today_restaurant_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant TEXT NOT NULL DEFAULT '',
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            UNIQUE(tenant, date, meal_type),
+            FOREIGN KEY (restaurant_id) REFERENCES restaurant(id)
+        )''',
+        '''INSERT INTO today_restaurant_new (id, date, meal_type, restaurant_id)
+           SELECT id, date, meal_type, restaurant_id FROM today_restaurant''',
+        'DROP TABLE today_restaurant',
+        'ALTER TABLE today_restaurant_new RENAME TO today_restaurant',
+        # 截止時找出當餐所有群組
+        'CREATE INDEX IF NOT EXISTS idx_today_restaurant_date ON today_restaurant (date, meal_type)',
+        '''CREATE TABLE order_summary_new (
+            tenant TEXT NOT NULL DEFAULT '',
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            menu_item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (tenant, date, meal_type, restaurant_id, user_id, menu_item_id)
+        ) WITHOUT ROWID''',
+        '''INSERT INTO order_summary_new (date, meal_type, restaurant_id, user_id, menu_item_id, quantity, amount)
+           SELECT date, meal_type, restaurant_id, user_id, menu_item_id, quantity, amount FROM order_summary''',
+        'DROP TABLE order_summary',
+        'ALTER TABLE order_summary_new RENAME TO order_summary',
+        '''CREATE TABLE order_summary_text_new (
+            tenant TEXT NOT NULL DEFAULT '',
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (tenant, date, meal_type, restaurant_id)
+        ) WITHOUT ROWID''',
+        '''INSERT INTO order_summary_text_new (date, meal_type, restaurant_id, text)
+           SELECT date, meal_type, restaurant_id, text FROM order_summary_text''',
+        'DROP TABLE order_summary_text',
+        'ALTER TABLE order_summary_text_new RENAME TO order_summary_text',
+        # 截止時間各群組相同，meal_cutoff 維持全域；報表則是每個群組各一份
+        '''CREATE TABLE meal_report_new (
+            tenant TEXT NOT NULL DEFAULT '',
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (tenant, date, meal_type, restaurant_id)
+        ) WITHOUT ROWID''',
+        '''INSERT INTO meal_report_new (date, meal_type, restaurant_id, text, total)
+           SELECT date, meal_type, restaurant_id, text, total FROM meal_report''',
+        'DROP TABLE meal_report',
+        'ALTER TABLE meal_report_new RENAME TO meal_report',
+        # 同一個人在不同群組可以各有一個進行中的點餐流程
+        '''CREATE TABLE pending_order_new (
+            tenant TEXT NOT NULL DEFAULT '',
+            line_user_id TEXT NOT NULL,
+            menu_item_id INTEGER NOT NULL,
+            step TEXT NOT NULL,
+            sweetness TEXT,
+            ice TEXT,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (tenant, line_user_id)
+        ) WITHOUT ROWID''',
+        '''INSERT INTO pending_order_new (line_user_id, menu_item_id, step, sweetness, ice, expires_at)
+           SELECT line_user_id, menu_item_id, step, sweetness, ice, expires_at FROM pending_order''',
+        'DROP TABLE pending_order',
+        'ALTER TABLE pending_order_new RENAME TO pending_order',
+        'CREATE INDEX IF NOT EXISTS idx_pending_order_expires ON pending_order (expires_at)',
+        # order_record 加 tenant：全體對帳走日期開頭的索引，單一群組對帳走 tenant 開頭的索引
+        "ALTER TABLE order_record ADD COLUMN tenant TEXT NOT NULL DEFAULT ''",
+        'DROP INDEX IF EXISTS idx_order_record_date_user',
+        'CREATE INDEX IF NOT EXISTS idx_order_record_date_user ON order_record (date, meal_type, user_id, menu_item_id, quantity, tenant)',
+        'CREATE INDEX IF NOT EXISTS idx_order_record_tenant_date ON order_record (tenant, date, meal_type, user_id, menu_item_id, quantity)',
+    )),
+    (12, (
+        # 點餐當下的單價：增量匯入會就地修改 menu_item.price，已對帳的月份不能跟著變
+        # 既有紀錄沒有當時的價格，只能以目前菜單價格補上
+        'ALTER TABLE order_record ADD COLUMN price INTEGER',
+        '''UPDATE order_record SET price = (SELECT price FROM menu_item WHERE id = order_record.menu_item_id)
+           WHERE price IS NULL''',
+        # 對帳匯出仍只讀索引
+        'DROP INDEX IF EXISTS idx_order_record_date_user',
+        'CREATE INDEX IF NOT EXISTS idx_order_record_date_user ON order_record (date, meal_type, user_id, menu_item_id, quantity, tenant, price)',
+        'DROP INDEX IF EXISTS idx_order_record_tenant_date',
+        'CREATE INDEX IF NOT EXISTS idx_order_record_tenant_date ON order_record (tenant, date, meal_type, user_id, menu_item_id, quantity, price)',
+    )),
+]
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 多個 worker 同時啟動時，拿到寫入鎖前可能已被其他行程套用
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if target <= version:
+                conn.rollback()
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f'PRAGMA user_version={target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+    return version
+
+def get_menu_generation(conn):
+    row = conn.execute("SELECT value FROM app_meta WHERE key='menu_generation'").fetchone()
+    return row[0] if row else 0
+
+def bump_menu_generation(conn):
+    # 需在匯入的同一個交易內呼叫
+    conn.execute('''INSERT INTO app_meta (key, value) VALUES ('menu_generation', 1)
+                    ON CONFLICT(key) DO UPDATE SET value = value + 1''')
 
 if __name__ == '__main__':
     init_db()
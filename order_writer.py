@@ -0,0 +1,231 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from models import connect, get_db
+from orders import MealClosed, is_meal_closed, record_order
+
+logger = logging.getLogger(__name__)
+
+# 點餐寫入集中到單一 writer 執行緒，多筆訂單共用一次 commit（group commit）
+# ORDER_WRITE_MODE=direct 時在呼叫端直接寫入，不經過 writer
+ORDER_WRITE_MODE = os.getenv('ORDER_WRITE_MODE', 'batch')
+# 收到第一筆後最多再等多久湊同一批（秒）
+ORDER_BATCH_WINDOW = float(os.getenv('ORDER_BATCH_WINDOW_MS', '2')) / 1000
+ORDER_BATCH_MAX = int(os.getenv('ORDER_BATCH_MAX', '64'))
+ORDER_WRITE_TIMEOUT = float(os.getenv('ORDER_WRITE_TIMEOUT', '10'))
+# writer 的 commit 要真正落盤才回覆使用者；批次寫入攤平了 fsync 成本
+# writer 執行緒用自己的連線，不和處理訊息的執行緒搶連線池（它們會拿著連線等 writer）
+ORDER_SYNCHRONOUS = os.getenv('ORDER_SYNCHRONOUS', 'FULL')
+
+# tenant：群組 / 聊天室 id（一對一聊天為 ''）
+# lines：((MenuItem, 數量), ...)；同一筆 OrderWrite 的品項一起成功或一起失敗
+OrderWrite = namedtuple('OrderWrite', 'tenant line_user_id display_name date meal_type lines')
+
+USER_ID_SQL = 'SELECT id FROM user WHERE line_user_id=?'
+
+_STOP = object()
+
+
+def write_order(conn, order):
+    # 註冊用戶並寫入訂單，回傳 user.id；呼叫端負責交易
+    # 在寫入交易內再確認一次，其他行程已截止的餐別也擋得住
+    if is_meal_closed(conn, order.date, order.meal_type):
+        raise MealClosed(order.date, order.meal_type)
+    conn.execute('INSERT OR IGNORE INTO user (line_user_id, display_name) VALUES (?, ?)',
+                 (order.line_user_id, order.display_name))
+    user_db_id = conn.execute(USER_ID_SQL, (order.line_user_id,)).fetchone()[0]
+    for item, quantity in order.lines:
+        record_order(conn, order.tenant, user_db_id, order.date, order.meal_type, item, quantity)
+    return user_db_id
+
+
+class OrderWriter:
+    def __init__(self, mode=ORDER_WRITE_MODE, window=ORDER_BATCH_WINDOW, max_batch=ORDER_BATCH_MAX,
+                 timeout=ORDER_WRITE_TIMEOUT):
+        self.mode = mode
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.orders = 0
+        self.batches = 0
+        self.failed = 0
+        self.retried_batches = 0
+        self.largest_batch = 0
+        self.rejected = 0
+        # 本行程已知截止的 (date, meal_type)，不用進佇列就能拒絕
+        self.closed_meals = set()
+
+    def close_meal(self, date, meal_type):
+        self.closed_meals.add((date, meal_type))
+
+    def start(self):
+        # gunicorn fork 之後要在子行程重新啟動 writer
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self._run, name='order-writer', daemon=True)
+            self.thread.start()
+
+    def submit(self, order, conn=None):
+        # 回傳 Future，commit 完成後才有結果（user.id）
+        # conn：呼叫端已借到的連線，direct 模式直接用它寫入，不再向連線池借第二條
+        future = Future()
+        if (order.date, order.meal_type) in self.closed_meals:
+            with self._stats_lock:
+                self.rejected += 1
+            future.set_exception(MealClosed(order.date, order.meal_type))
+            return future
+        if self.mode == 'direct':
+            self._commit_direct([(order, future)], conn)
+            return future
+        self.start()
+        self.queue.put((order, future))
+        return future
+
+    def write(self, order, conn=None):
+        return self.submit(order, conn).result(self.timeout)
+
+    def _run(self):
+        conn = None
+        try:
+            while True:
+                first = self.queue.get()
+                if first is _STOP:
+                    return
+                batch, stop = self._collect(first)
+                try:
+                    if conn is None:
+                        conn = connect()
+                        conn.execute(f'PRAGMA synchronous={ORDER_SYNCHRONOUS}')
+                    self._commit(conn, batch)
+                except Exception as e:
+                    # 不論什麼錯誤都只讓這批失敗，writer 繼續處理下一批
+                    logger.exception('order writer 寫入失敗')
+                    if conn is not None and conn.in_transaction:
+                        conn.rollback()
+                    self._fail(batch, e)
+                if stop:
+                    return
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _collect(self, first):
+        batch = [first]
+        stop = False
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                stop = True
+                break
+            batch.append(entry)
+        return batch, stop
+
+    def _commit_direct(self, batch, conn=None):
+        # direct 模式在呼叫端執行緒寫入；呼叫端沒給連線時才向連線池借
+        borrowed = conn is None
+        try:
+            if borrowed:
+                conn = get_db()
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        try:
+            conn.execute(f'PRAGMA synchronous={ORDER_SYNCHRONOUS}')
+            self._commit(conn, batch)
+        except Exception as e:
+            self._fail(batch, e)
+        finally:
+            try:
+                conn.execute('PRAGMA synchronous=NORMAL')
+            finally:
+                if borrowed:
+                    conn.close()
+
+    def _commit(self, conn, batch):
+        try:
+            self._apply(conn, batch)
+        except MealClosed:
+            # 截止前排進佇列、截止後才輪到的訂單：不算錯誤，逐筆寫入讓它們各自被拒絕
+            conn.rollback()
+            self._apply_each(conn, batch)
+        except Exception:
+            conn.rollback()
+            logger.exception('批次寫入失敗，改為逐筆寫入')
+            with self._stats_lock:
+                self.retried_batches += 1
+            self._apply_each(conn, batch)
+
+    def _fail(self, batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+                with self._stats_lock:
+                    self.failed += 1
+
+    def _apply_each(self, conn, batch):
+        # 只讓有問題的那筆失敗，其餘照常寫入
+        for entry in batch:
+            try:
+                self._apply(conn, [entry])
+            except Exception as e:
+                conn.rollback()
+                entry[1].set_exception(e)
+                with self._stats_lock:
+                    if isinstance(e, MealClosed):
+                        self.rejected += 1
+                    else:
+                        self.failed += 1
+
+    def _apply(self, conn, batch):
+        conn.execute('BEGIN IMMEDIATE')
+        user_ids = [write_order(conn, order) for order, _ in batch]
+        conn.commit()
+        with self._stats_lock:
+            self.orders += len(batch)
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, future), user_db_id in zip(batch, user_ids):
+            future.set_result(user_db_id)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'mode': self.mode,
+                'orders': self.orders,
+                'batches': self.batches,
+                'avg_batch': round(self.orders / self.batches, 2) if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'retried_batches': self.retried_batches,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'queue_depth': self.queue.qsize(),
+            }
+
+    def shutdown(self, timeout=5.0):
+        # 先把已排隊的訂單寫完再結束
+        if self._pid != os.getpid():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self._pid = None
+
+
+order_writer = OrderWriter()
@@ -0,0 +1,143 @@
+# 點餐寫入與統計
+import time
+
+from favorites import record_favorite
+from picker import record_restaurant_orders
+
+# 統計與截止用到的查詢（query_plans.py 也用同一段 SQL 檢查索引）
+MEAL_REPORT_TEXT_SQL = 'SELECT text FROM meal_report WHERE tenant=? AND date=? AND meal_type=? AND restaurant_id=?'
+SUMMARY_TEXT_SQL = 'SELECT text FROM order_summary_text WHERE tenant=? AND date=? AND meal_type=? AND restaurant_id=?'
+SUMMARY_ROWS_SQL = '''SELECT u.display_name, mi.name, s.quantity, s.amount
+                      FROM order_summary s
+                      JOIN user u ON s.user_id = u.id
+                      JOIN menu_item mi ON s.menu_item_id = mi.id
+                      WHERE s.tenant=? AND s.date=? AND s.meal_type=? AND s.restaurant_id=?
+                      ORDER BY u.display_name, s.menu_item_id'''
+MEAL_CLOSED_SQL = 'SELECT 1 FROM meal_cutoff WHERE date=? AND meal_type=?'
+CUTOFF_TENANTS_SQL = 'SELECT tenant, restaurant_id FROM today_restaurant WHERE date=? AND meal_type=?'
+CUTOFF_ROWS_SQL = '''SELECT s.restaurant_id, u.display_name, mi.name, s.quantity, s.amount
+                     FROM order_summary s
+                     JOIN user u ON s.user_id = u.id
+                     JOIN menu_item mi ON s.menu_item_id = mi.id
+                     WHERE s.tenant=? AND s.date=? AND s.meal_type=?
+                     ORDER BY s.restaurant_id, u.display_name, s.menu_item_id'''
+
+
+def record_order(conn, tenant, user_db_id, date, meal_type, item, quantity):
+    # item 為 catalogue.MenuItem；tenant 為群組 id（一對一聊天為 ''）
+    # 呼叫端負責 commit，確保明細與加總在同一個交易
+    # 單價一併記下，之後菜單改價不影響已成立的訂單
+    conn.execute('''INSERT INTO order_record (tenant, user_id, date, meal_type, menu_item_id, quantity, price)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)''', (tenant, user_db_id, date, meal_type, item.id, quantity, item.price))
+    conn.execute('''INSERT INTO order_summary (tenant, date, meal_type, restaurant_id, user_id, menu_item_id, quantity, amount)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (tenant, date, meal_type, restaurant_id, user_id, menu_item_id)
+                    DO UPDATE SET quantity = quantity + excluded.quantity, amount = amount + excluded.amount''',
+                 (tenant, date, meal_type, item.restaurant_id, user_db_id, item.id, quantity, quantity * item.price))
+    conn.execute('DELETE FROM order_summary_text WHERE tenant=? AND date=? AND meal_type=? AND restaurant_id=?',
+                 (tenant, date, meal_type, item.restaurant_id))
+    record_restaurant_orders(conn, item.restaurant_id, quantity)
+    record_favorite(conn, user_db_id, date, item, quantity)
+
+
+def render_summary(meal_type, restaurant_name, rows):
+    lines = [f"今日{meal_type} {restaurant_name} 點餐統計："]
+    if not rows:
+        lines.append("尚無點餐紀錄。")
+        return "\n".join(lines)
+    summary = {}
+    total_sum = 0
+    for row in rows:
+        name = row[0] or "(未知)"
+        total_sum += row[3]
+        summary.setdefault(name, []).append(f"{row[1]} x{row[2]} = ${row[3]}")
+    for name, items in summary.items():
+        lines.append(f"{name}：")
+        lines.extend([f"  {i}" for i in items])
+    lines.append(f"\n總金額：${total_sum}")
+    return "\n".join(lines)
+
+
+def get_summary_text(conn, tenant, date, meal_type, restaurant_id, restaurant_name):
+    key = (tenant, date, meal_type, restaurant_id)
+    # 已截止的餐別直接回傳凍結的報表
+    row = conn.execute(MEAL_REPORT_TEXT_SQL, key).fetchone()
+    if row:
+        return row[0]
+    row = conn.execute(SUMMARY_TEXT_SQL, key).fetchone()
+    if row:
+        return row[0]
+    # 沒有快取：在寫入鎖內重算，避免和同時寫入的訂單互相覆蓋
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(SUMMARY_TEXT_SQL, key).fetchone()
+        if row:
+            conn.rollback()
+            return row[0]
+        rows = conn.execute(SUMMARY_ROWS_SQL, key).fetchall()
+        text = render_summary(meal_type, restaurant_name, rows)
+        conn.execute('''INSERT INTO order_summary_text (tenant, date, meal_type, restaurant_id, text)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     key + (text,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return text
+
+
+class MealClosed(Exception):
+    # 餐別已截止，訂單不再寫入
+    def __init__(self, date, meal_type):
+        super().__init__(f'{date} {meal_type} 已截止')
+        self.date = date
+        self.meal_type = meal_type
+
+
+def is_meal_closed(conn, date, meal_type):
+    return conn.execute(MEAL_CLOSED_SQL, (date, meal_type)).fetchone() is not None
+
+
+def render_report(meal_type, restaurant_name, rows):
+    # 截止後的最終報表：每人明細、給店家的品項數量、總金額
+    text = render_summary(meal_type, restaurant_name, rows).replace("點餐統計", "點餐統計（已截止）", 1)
+    if not rows:
+        return text
+    totals = {}
+    for row in rows:
+        qty, amount = totals.get(row[1], (0, 0))
+        totals[row[1]] = (qty + row[2], amount + row[3])
+    lines = [text, "", "店家訂購數量："]
+    lines.extend(f"  {name} x{qty} = ${amount}" for name, (qty, amount) in totals.items())
+    return "\n".join(lines)
+
+
+def freeze_meal(conn, date, meal_type, restaurant_names):
+    # 截止時把每個群組該餐的訂單凍結成各店家的報表；已凍結過就回傳 False
+    # restaurant_names：{restaurant_id: 店名}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if is_meal_closed(conn, date, meal_type):
+            conn.rollback()
+            return False
+        # 點餐前一定要先設定今日餐廳，所以有訂單的群組都在 today_restaurant 裡
+        tenants = conn.execute(CUTOFF_TENANTS_SQL, (date, meal_type)).fetchall()
+        for tenant, today_restaurant_id in tenants:
+            rows = conn.execute(CUTOFF_ROWS_SQL, (tenant, date, meal_type)).fetchall()
+            # 今日餐廳沒人點也要有報表
+            per_restaurant = {today_restaurant_id: []}
+            for row in rows:
+                per_restaurant.setdefault(row[0], []).append(tuple(row)[1:])
+            for restaurant_id, items in per_restaurant.items():
+                name = restaurant_names.get(restaurant_id, str(restaurant_id))
+                conn.execute('''INSERT INTO meal_report (tenant, date, meal_type, restaurant_id, text, total)
+                                VALUES (?, ?, ?, ?, ?, ?)''',
+                             (tenant, date, meal_type, restaurant_id, render_report(meal_type, name, items),
+                              sum(item[3] for item in items)))
+        conn.execute('INSERT INTO meal_cutoff (date, meal_type, frozen_at) VALUES (?, ?, ?)',
+                     (date, meal_type, time.time()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
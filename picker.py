@@ -0,0 +1,110 @@
+import datetime
+import math
+import os
+import random
+import threading
+
+# 隨便吃 / 隨便喝：依人氣加權、避開最近選過的店
+# 最近幾天內選過的店不列入候選
+PICKER_EXCLUDE_DAYS = int(os.getenv('PICKER_EXCLUDE_DAYS', '3'))
+# 選過之後經過幾天權重才完全恢復
+PICKER_RECOVERY_DAYS = float(os.getenv('PICKER_RECOVERY_DAYS', '14'))
+# 剛過排除期的店至少保留的權重比例
+PICKER_MIN_RECENCY = 0.1
+
+
+def bump_picker_generation(conn):
+    conn.execute('''INSERT INTO app_meta (key, value) VALUES ('picker_generation', 1)
+                    ON CONFLICT(key) DO UPDATE SET value = value + 1''')
+
+
+def get_picker_generation(conn):
+    row = conn.execute("SELECT value FROM app_meta WHERE key='picker_generation'").fetchone()
+    return row[0] if row else 0
+
+
+def record_pick(conn, restaurant_id, date):
+    # 設定今日餐廳或隨便喝選中時呼叫；呼叫端負責 commit
+    conn.execute('''INSERT INTO restaurant_stats (restaurant_id, last_picked, picks) VALUES (?, ?, 1)
+                    ON CONFLICT(restaurant_id) DO UPDATE SET
+                        last_picked = max(coalesce(last_picked, ''), excluded.last_picked), picks = picks + 1''',
+                 (restaurant_id, date))
+    bump_picker_generation(conn)
+
+
+def record_restaurant_orders(conn, restaurant_id, quantity):
+    # 與 order_record 同一個交易更新；只累加計數，不動 picker_generation（避免每筆訂單都寫同一列、重建抽樣表）
+    # 訂單數對權重影響很小（取 log），換日或下次選店時才會反映
+    conn.execute('''INSERT INTO restaurant_stats (restaurant_id, orders) VALUES (?, ?)
+                    ON CONFLICT(restaurant_id) DO UPDATE SET orders = orders + excluded.orders''',
+                 (restaurant_id, quantity))
+
+
+def restaurant_weight(picks, orders, last_picked, today):
+    days = (today - datetime.date.fromisoformat(last_picked)).days if last_picked else None
+    if days is not None and days < PICKER_EXCLUDE_DAYS:
+        return 0.0
+    popularity = 1.0 + math.log1p(orders) + math.log1p(picks)
+    recency = 1.0 if days is None else max(PICKER_MIN_RECENCY, min(1.0, days / PICKER_RECOVERY_DAYS))
+    return popularity * recency
+
+
+class AliasTable:
+    # Vose alias method：建表 O(n)，每次抽樣 O(1)
+    def __init__(self, items, weights):
+        n = len(items)
+        total = sum(weights)
+        self.items = list(items)
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def draw(self, rng=random):
+        i = rng.randrange(len(self.items))
+        return self.items[i] if rng.random() < self.prob[i] else self.items[self.alias[i]]
+
+
+class RestaurantPicker:
+    # 有選店（picker_generation 改變）或換日才重新讀取計數並重建抽樣表
+    def __init__(self):
+        self._generation = None
+        self._loaded_on = None
+        self._stats = {}
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _load(self, conn):
+        rows = conn.execute('SELECT restaurant_id, picks, orders, last_picked FROM restaurant_stats').fetchall()
+        self._stats = {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    def table(self, conn, restaurants, today):
+        generation = get_picker_generation(conn)
+        key = (tuple(r.id for r in restaurants), today)
+        with self._lock:
+            if generation != self._generation or today != self._loaded_on:
+                self._load(conn)
+                self._generation = generation
+                self._loaded_on = today
+                self._tables = {}
+            table = self._tables.get(key)
+            if table is None:
+                day = datetime.date.fromisoformat(today)
+                weights = [restaurant_weight(*self._stats.get(r.id, (0, 0, None)), day) for r in restaurants]
+                if not any(weights):
+                    # 全部都在排除期內就平均抽
+                    weights = [1.0] * len(restaurants)
+                table = self._tables[key] = AliasTable(restaurants, weights)
+            return table
+
+    def pick(self, conn, restaurants, today):
+        return self.table(conn, restaurants, today).draw()
@@ -0,0 +1,117 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from models import get_db
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', str(6 * 3600)))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '1024'))
+
+DISPLAY_NAME_SQL = 'SELECT display_name FROM user WHERE line_user_id=?'
+
+
+class ProfileCache:
+    # LINE 顯示名稱快取：記憶體 LRU/TTL -> user 表 -> get_profile
+    def __init__(self, fetch, ttl=PROFILE_CACHE_TTL, max_size=PROFILE_CACHE_SIZE):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # line_user_id -> (display_name, loaded_at)
+        self._lock = threading.Lock()
+        self._refresh_queue = queue.Queue()
+        self._refreshing = set()
+        self._thread = None
+        self._pid = None
+
+    def _put(self, user_id, display_name, loaded_at=None):
+        with self._lock:
+            self._entries[user_id] = (display_name, loaded_at if loaded_at is not None else time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id, conn=None):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry:
+                self._entries.move_to_end(user_id)
+        if entry:
+            display_name, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                # 過期先回舊值，背景更新
+                self._schedule_refresh(user_id)
+            return display_name
+        # 記憶體沒有：先查 user 表
+        row = None
+        if conn is not None:
+            row = conn.execute(DISPLAY_NAME_SQL, (user_id,)).fetchone()
+        if row and row[0]:
+            self._put(user_id, row[0])
+            return row[0]
+        # 第一次見到的使用者才同步呼叫 get_profile
+        display_name = self._fetch(user_id)
+        if display_name:
+            self._put(user_id, display_name)
+        return display_name
+
+    def _fetch(self, user_id):
+        try:
+            return self.fetch(user_id)
+        except Exception:
+            logger.warning('get_profile 失敗：%s', user_id)
+            return None
+
+    def warm(self, limit=None):
+        # 啟動時從 user 表預載顯示名稱
+        limit = limit or self.max_size
+        conn = get_db()
+        rows = conn.execute('SELECT line_user_id, display_name FROM user WHERE display_name IS NOT NULL '
+                            'ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        conn.close()
+        for row in reversed(rows):
+            self._put(row[0], row[1])
+        return len(rows)
+
+    def _schedule_refresh(self, user_id):
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            self._refreshing.add(user_id)
+        self._start()
+        self._refresh_queue.put(user_id)
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._refresh_loop, name='profile-refresh', daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            user_id = self._refresh_queue.get()
+            try:
+                display_name = self._fetch(user_id)
+                if display_name:
+                    self._put(user_id, display_name)
+                    conn = get_db()
+                    conn.execute('UPDATE user SET display_name=? WHERE line_user_id=?', (display_name, user_id))
+                    conn.commit()
+                    conn.close()
+                else:
+                    # 取不到就延長舊值，避免每次都重試
+                    with self._lock:
+                        entry = self._entries.get(user_id)
+                    if entry:
+                        self._put(user_id, entry[0])
+            except Exception:
+                logger.exception('更新使用者名稱失敗：%s', user_id)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(user_id)
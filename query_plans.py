@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import sys
+import tempfile
+from models import DB_NAME, connect, init_db
+from commands import TODAY_RESTAURANT_SQL, TODAY_RESTAURANT_ANY_MEAL_SQL
+from favorites import TOP_FAVORITES_SQL
+from order_writer import USER_ID_SQL
+from orders import (MEAL_REPORT_TEXT_SQL, SUMMARY_TEXT_SQL, SUMMARY_ROWS_SQL, MEAL_CLOSED_SQL,
+                    CUTOFF_TENANTS_SQL, CUTOFF_ROWS_SQL)
+from profile_cache import DISPLAY_NAME_SQL
+from reports import export_sql
+from search import search_sql
+from session_store import PENDING_ORDER_SQL
+
+# 熱門查詢，任何一條出現 SCAN（全表掃描）就視為退化
+# SQL 直接取自程式實際執行的常數；值為 SQL 字串，或 (SQL, 參數) 給需要實際參數才能產生計畫的查詢
+HOT_QUERIES = {
+    '統計': SUMMARY_ROWS_SQL,
+    '統計快取': SUMMARY_TEXT_SQL,
+    '截止報表': MEAL_REPORT_TEXT_SQL,
+    '截止檢查': MEAL_CLOSED_SQL,
+    '截止群組': CUTOFF_TENANTS_SQL,
+    '截止明細': CUTOFF_ROWS_SQL,
+    '今日餐廳': TODAY_RESTAURANT_SQL,
+    '吃啥 / 喝啥': TODAY_RESTAURANT_ANY_MEAL_SQL,
+    '常點': TOP_FAVORITES_SQL,
+    '點餐流程': PENDING_ORDER_SQL,
+    '點餐 用戶': USER_ID_SQL,
+    '顯示名稱': DISPLAY_NAME_SQL,
+    # 3 個字以上走 trigram 索引；較短的關鍵字本來就是 instr 逐筆比對
+    '搜尋': search_sql('珍珠奶茶'),
+    '對帳匯出': export_sql('order_record'),
+    '群組對帳匯出': export_sql('order_record', 'tenant'),
+}
+
+def explain(conn, sql, params=None):
+    if params is None:
+        params = (None,) * sql.count('?')
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+def is_scan(step):
+    # 虛擬表（FTS5）的計畫一律寫成 SCAN，有用到索引時 INDEX 後面會帶條件（例如 32:M3）
+    if ' VIRTUAL TABLE INDEX ' in step:
+        return not step.split(':', 1)[-1]
+    return step.startswith('SCAN ')
+
+def check_query_plans(conn):
+    # 回傳 {查詢名稱: 查詢計畫}，只列出有全表掃描的查詢
+    failures = {}
+    for name, query in HOT_QUERIES.items():
+        plan = explain(conn, *query) if isinstance(query, tuple) else explain(conn, query)
+        if any(is_scan(step) for step in plan):
+            failures[name] = plan
+    return failures
+
+if __name__ == '__main__':
+    # python query_plans.py [資料庫]：在暫存複本上套用 migration 後檢查，不會改動原本的資料庫
+    source = sys.argv[1] if len(sys.argv) > 1 else DB_NAME
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, 'query_plans.sqlite3'))
+        if os.path.exists(source):
+            src = sqlite3.connect(source)
+            src.backup(conn)
+            src.close()
+        init_db(conn)
+        failures = check_query_plans(conn)
+        conn.close()
+    for name, plan in failures.items():
+        print(f'{name}: ' + ' / '.join(plan))
+    if failures:
+        sys.exit(1)
+    print('所有熱門查詢都有使用索引')
@@ -0,0 +1,147 @@
+# 對帳匯出：依日期區間串流輸出 order_record 明細與每個群組每人每月小計（CSV / JSON Lines）
+import csv
+import datetime
+import hmac
+import io
+import json
+import os
+
+from archive import archive_attached, history_sources
+from models import get_db
+
+# 未設定時 /admin/export 不開放
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+# 每次從 cursor 取出的筆數與每次送出的資料量，記憶體用量與匯出區間長短無關
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '500'))
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', '65536'))
+
+EXPORT_COLUMNS = ('kind', 'tenant', 'month', 'date', 'meal_type', 'line_user_id', 'display_name',
+                  'restaurant', 'item', 'quantity', 'price', 'amount')
+
+
+def check_admin_token(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or '', ADMIN_TOKEN)
+
+
+def parse_export_args(args, today):
+    # args 為 query string 的 dict；格式錯誤時丟 ValueError；沒指定 tenant 時匯出所有群組
+    end = datetime.date.fromisoformat(args.get('end') or today)
+    start = datetime.date.fromisoformat(args.get('start') or end.replace(day=1).isoformat())
+    if start > end:
+        raise ValueError('start 不可晚於 end')
+    fmt = args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'不支援的格式：{fmt}')
+    return start.isoformat(), end.isoformat(), fmt, args.get('tenant')
+
+
+def iter_order_rows(conn, start, end, tenant=None):
+    # 歸檔月份在前、live 表在後，串起來仍依日期排序
+    with archive_attached(conn) as attached:
+        for table, table_start in history_sources(conn, start, end, attached):
+            yield from iter_table_rows(conn, table, table_start, end, tenant)
+
+
+def export_sql(table, tenant=None):
+    # 依 (date, meal_type, user_id) 的索引順序掃描，不需另外排序；指定群組時改走 tenant 開頭的索引
+    # 參數為 ([tenant,] start, end)；價格為點餐當下記錄的單價，菜單之後改價不影響已對帳的金額
+    where = 'orr.date BETWEEN ? AND ?'
+    if tenant is not None:
+        where = 'orr.tenant=? AND ' + where
+    return f'''SELECT orr.tenant, orr.date, orr.meal_type, u.line_user_id, u.display_name,
+                      r.name, mi.name, orr.quantity, orr.price
+               FROM {table} orr
+               JOIN user u ON orr.user_id = u.id
+               JOIN menu_item mi ON orr.menu_item_id = mi.id
+               JOIN menu_category mc ON mi.category_id = mc.id
+               JOIN restaurant r ON mc.restaurant_id = r.id
+               WHERE {where}
+               ORDER BY orr.date, orr.meal_type, orr.user_id'''
+
+
+def iter_table_rows(conn, table, start, end, tenant=None):
+    params = (start, end) if tenant is None else (tenant, start, end)
+    cursor = conn.execute(export_sql(table, tenant), params)
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        # 客戶端中斷時也要結束查詢，才能 DETACH 歸檔庫
+        cursor.close()
+
+
+def subtotal_records(month, subtotals):
+    for (tenant, line_user_id, display_name), (quantity, amount) in sorted(
+            subtotals.items(), key=lambda kv: (kv[0][0], kv[0][2] or '')):
+        yield {'kind': 'subtotal', 'tenant': tenant, 'month': month, 'date': '', 'meal_type': '', 'line_user_id': line_user_id,
+               'display_name': display_name, 'restaurant': '', 'item': '', 'quantity': quantity, 'price': '',
+               'amount': amount}
+
+
+def iter_export(conn, start, end, tenant=None):
+    # 明細依日期排序，每個月結束時接著輸出該月每個群組每人的小計；只保留當月的小計
+    month, subtotals = None, {}
+    for row in iter_order_rows(conn, start, end, tenant):
+        order_tenant, date, meal_type, line_user_id, display_name, restaurant, item, quantity, price = row
+        if date[:7] != month:
+            yield from subtotal_records(month, subtotals)
+            month, subtotals = date[:7], {}
+        key = (order_tenant, line_user_id, display_name)
+        total_quantity, total_amount = subtotals.get(key, (0, 0))
+        subtotals[key] = (total_quantity + quantity, total_amount + quantity * price)
+        yield {'kind': 'order', 'tenant': order_tenant, 'month': month, 'date': date, 'meal_type': meal_type, 'line_user_id': line_user_id,
+               'display_name': display_name, 'restaurant': restaurant, 'item': item, 'quantity': quantity,
+               'price': price, 'amount': quantity * price}
+    yield from subtotal_records(month, subtotals)
+
+
+def export_csv(records):
+    # 加 BOM 讓 Excel 正確辨識 UTF-8 中文
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.DictWriter(buffer, EXPORT_COLUMNS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def export_jsonl(records):
+    chunk = []
+    size = 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield ''.join(chunk).encode('utf-8')
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+
+# 格式 -> (輸出函式, Content-Type, 副檔名)
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv; charset=utf-8', 'csv'),
+    'jsonl': (export_jsonl, 'application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+
+def stream_export(start, end, fmt, tenant=None):
+    # 產生器自己借連線，回應送完（或客戶端中斷）時才歸還
+    conn = get_db()
+    try:
+        yield from EXPORT_FORMATS[fmt][0](iter_export(conn, start, end, tenant))
+    finally:
+        conn.close()
+
+
+def export_filename(start, end, fmt):
+    return f'orders_{start}_{end}.{EXPORT_FORMATS[fmt][2]}'
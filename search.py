@@ -0,0 +1,57 @@
+# 跨餐廳品項搜尋（FTS5 trigram 索引，rowid 即 menu_item.id）
+
+SEARCH_PAGE_SIZE = 10
+# trigram 至少要 3 個字才能用索引，較短的關鍵字改用 instr 過濾
+TRIGRAM_MIN = 3
+
+
+def refresh_search_index(conn, restaurant_ids=None):
+    # 需在匯入的同一個交易內呼叫；restaurant_ids 為 None 時整個重建
+    if restaurant_ids is None:
+        conn.execute('DELETE FROM menu_search')
+        where, params = '', ()
+    else:
+        restaurant_ids = list(restaurant_ids)
+        if not restaurant_ids:
+            return
+        marks = ','.join('?' * len(restaurant_ids))
+        conn.execute(f'''DELETE FROM menu_search WHERE rowid IN (
+                            SELECT mi.id FROM menu_item mi JOIN menu_category mc ON mi.category_id = mc.id
+                            WHERE mc.restaurant_id IN ({marks}))''', restaurant_ids)
+        where, params = f'AND r.id IN ({marks})', tuple(restaurant_ids)
+    conn.execute(f'''INSERT INTO menu_search (rowid, name, category, restaurant)
+                     SELECT mi.id, mi.name, mc.name, r.name
+                     FROM menu_item mi
+                     JOIN menu_category mc ON mi.category_id = mc.id
+                     JOIN restaurant r ON mc.restaurant_id = r.id
+                     WHERE mi.active=1 AND mc.active=1 AND r.active=1 {where}''', params)
+
+
+def search_sql(query, page=1, page_size=SEARCH_PAGE_SIZE):
+    # 回傳 (sql, params)；沒有關鍵字時回傳 None（query_plans.py 也用這個產生要檢查的 SQL）
+    terms = query.split()
+    if not terms:
+        return None
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN]
+    clauses, params = [], []
+    if long_terms:
+        clauses.append('menu_search MATCH ?')
+        params.append(' '.join('"' + t.replace('"', '""') + '"' for t in long_terms))
+    for t in short_terms:
+        clauses.append('(instr(name, ?) > 0 OR instr(category, ?) > 0 OR instr(restaurant, ?) > 0)')
+        params.extend([t, t, t])
+    order = 'rank' if long_terms else 'rowid'
+    sql = f'''SELECT rowid FROM menu_search WHERE {' AND '.join(clauses)}
+              ORDER BY {order} LIMIT ? OFFSET ?'''
+    return sql, params + [page_size + 1, (page - 1) * page_size]
+
+
+def search_items(conn, query, page=1, page_size=SEARCH_PAGE_SIZE):
+    # 回傳 (menu_item id 清單, 是否還有下一頁)，依相關度排序
+    statement = search_sql(query, page, page_size)
+    if statement is None:
+        return [], False
+    rows = conn.execute(*statement).fetchall()
+    ids = [row[0] for row in rows]
+    return ids[:page_size], len(ids) > page_size
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# quick reply 流程暫存：memory 只在單一行程內有效，sqlite 可跨 gunicorn worker 共用
+# 方法都帶入處理訊息時已借到的連線（memory 不使用），同一則訊息不會向連線池借第二條
+SESSION_STORE = os.getenv('SESSION_STORE', 'sqlite')
+SESSION_TTL = float(os.getenv('SESSION_TTL', '600'))
+SESSION_MAX = int(os.getenv('SESSION_MAX', '10000'))
+
+# key 為 (tenant, line_user_id)
+# step：food_qty（餐點選份數）、sweetness、ice、drink_qty（飲料選杯數）
+PendingOrder = namedtuple('PendingOrder', 'menu_item_id step sweetness ice')
+PendingOrder.__new__.__defaults__ = (None, None)
+
+PENDING_ORDER_SQL = '''SELECT menu_item_id, step, sweetness, ice FROM pending_order
+                       WHERE tenant=? AND line_user_id=? AND expires_at > ?'''
+
+
+class MemorySessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_size=SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (PendingOrder, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, conn, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def set(self, conn, key, state):
+        with self._lock:
+            self._entries[key] = (state, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            # 超過上限就丟掉最久沒動的流程
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, conn, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteSessionStore:
+    # 每 PURGE_EVERY 次寫入清一次過期資料並限制筆數
+    PURGE_EVERY = 100
+
+    def __init__(self, ttl=SESSION_TTL, max_size=SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._writes = 0
+
+    def get(self, conn, key):
+        row = conn.execute(PENDING_ORDER_SQL, key + (time.time(),)).fetchone()
+        return PendingOrder(*row) if row else None
+
+    def set(self, conn, key, state):
+        conn.execute('''INSERT OR REPLACE INTO pending_order (tenant, line_user_id, menu_item_id, step, sweetness, ice, expires_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', key + tuple(state) + (time.time() + self.ttl,))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._purge(conn)
+        conn.commit()
+
+    def delete(self, conn, key):
+        conn.execute('DELETE FROM pending_order WHERE tenant=? AND line_user_id=?', key)
+        conn.commit()
+
+    def _purge(self, conn):
+        conn.execute('DELETE FROM pending_order WHERE expires_at <= ?', (time.time(),))
+        conn.execute('''DELETE FROM pending_order WHERE (tenant, line_user_id) IN (
+                            SELECT tenant, line_user_id FROM pending_order ORDER BY expires_at DESC LIMIT -1 OFFSET ?)''',
+                     (self.max_size,))
+
+
+def make_session_store(kind=SESSION_STORE):
+    if kind == 'memory':
+        return MemorySessionStore()
+    if kind == 'sqlite':
+        return SQLiteSessionStore()
+    raise ValueError(f'未知的 SESSION_STORE：{kind}')
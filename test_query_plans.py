@@ -0,0 +1,13 @@
+from models import connect, init_db
+from query_plans import HOT_QUERIES, check_query_plans
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    # 全新資料庫套用所有 migration 後，熱門查詢都不應出現全表掃描
+    conn = connect(str(tmp_path / 'db.sqlite3'))
+    try:
+        init_db(conn)
+        assert HOT_QUERIES
+        assert check_query_plans(conn) == {}
+    finally:
+        conn.close()
@@ -0,0 +1,150 @@
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# 非同步 webhook 設定（WEBHOOK_MODE=thread 時啟用）
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'sync')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '256'))
+# 佇列滿時 /callback 最多等待秒數（背壓），超過就回 503 讓 LINE 重送
+# 不可改在請求執行緒直接處理：同一位使用者較早的事件可能還在佇列裡，順序會亂
+WEBHOOK_PUT_TIMEOUT = float(os.getenv('WEBHOOK_PUT_TIMEOUT', '10'))
+
+_STOP = object()
+
+
+def event_key(event):
+    # 同一位使用者的事件永遠進同一個 worker，確保 quick reply 步驟依序執行
+    source = getattr(event, 'source', None)
+    return getattr(source, 'user_id', None) or getattr(source, 'group_id', None) \
+        or getattr(source, 'room_id', None) or ''
+
+
+class EventDispatcher:
+    def __init__(self, handle, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE,
+                 put_timeout=WEBHOOK_PUT_TIMEOUT):
+        self.handle = handle
+        self.workers = max(1, workers)
+        self.put_timeout = put_timeout
+        # 每個 worker 一條佇列，各自最多 per_queue 筆，總容量約為 queue_size
+        # 容量由 depths 控管：同一個 webhook 的事件一次保留位置，要嘛全部排入、要嘛全部不排
+        self.per_queue = max(1, queue_size // self.workers)
+        self.queues = [queue.Queue() for _ in range(self.workers)]
+        self.depths = [0] * self.workers
+        self._space = threading.Condition()
+        self.threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        # gunicorn fork 之後要在子行程重新啟動 worker
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, args=(i,), name=f'webhook-worker-{i}', daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def submit(self, event):
+        return self.submit_all([event])
+
+    def submit_all(self, events):
+        # 回傳 False 代表等待 put_timeout 後仍放不下整批事件，一筆都沒有排入，呼叫端應回 503
+        # 不可只排入前面幾筆：LINE 會重送整個 webhook，已排入的事件會被處理兩次（重複點餐）
+        self.start()
+        indexes = [zlib.crc32(event_key(event).encode('utf-8')) % self.workers for event in events]
+        needed = {}
+        for index in indexes:
+            needed[index] = needed.get(index, 0) + 1
+        deadline = time.monotonic() + self.put_timeout
+        with self._space:
+            # 單一佇列超過容量的大批事件，等該佇列清空後也放行
+            while not all(self.depths[i] == 0 or self.depths[i] + n <= self.per_queue for i, n in needed.items()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._stats_lock:
+                        self.rejected += len(events)
+                    return False
+                self._space.wait(remaining)
+            # 在鎖內排入，同一位使用者在不同 webhook 的事件不會交錯
+            queued_at = time.monotonic()
+            for index, event in zip(indexes, events):
+                self.depths[index] += 1
+                self.queues[index].put((queued_at, event))
+            depth = max(self.depths[i] for i in needed) if needed else 0
+        with self._stats_lock:
+            self.enqueued += len(events)
+            self.max_depth = max(self.max_depth, depth)
+        return True
+
+    def _run(self, index):
+        q = self.queues[index]
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                with self._space:
+                    self.depths[index] -= 1
+                    self._space.notify_all()
+                queued_at, event = item
+                waited = time.monotonic() - queued_at
+                try:
+                    self.handle(event)
+                    ok = True
+                except Exception:
+                    logger.exception('webhook event 處理失敗')
+                    ok = False
+                with self._stats_lock:
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+                    if ok:
+                        self.processed += 1
+                    else:
+                        self.failed += 1
+            finally:
+                q.task_done()
+
+    def stats(self):
+        with self._stats_lock:
+            done = self.processed + self.failed
+            return {
+                'mode': WEBHOOK_MODE,
+                'workers': self.workers,
+                'queue_capacity': self.per_queue * self.workers,
+                'queue_depth': [q.qsize() for q in self.queues],
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'wait_avg_ms': round(self.wait_total / done * 1000, 3) if done else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+    def shutdown(self, timeout=5.0):
+        # 等佇列內的事件處理完再結束
+        if self._pid != os.getpid():
+            return
+        for q in self.queues:
+            q.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for t in self.threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self._pid = None